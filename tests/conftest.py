@@ -0,0 +1,49 @@
+import contextlib
+import copy
+import json
+import logging
+from pathlib import Path
+
+import pytest
+from poke_env.environment import DoubleBattle
+
+fixtures = Path(__file__).parent / "fixtures"
+
+# src.utils reads its vocabularies from data/ when it is first imported, so it is imported here,
+# before any test module, against the small checked-in ones instead of the scraped data
+with contextlib.chdir(fixtures):
+    import src.utils
+
+
+@pytest.fixture(scope="session")
+def snapshots() -> list[tuple[DoubleBattle, list[int]]]:
+    # replays battle.json (protocol messages and requests from alice's side of a short doubles
+    # battle) and snapshots the battle at every request
+    with open(fixtures / "battle.json") as f:
+        fixture = json.load(f)
+    battle = DoubleBattle(
+        fixture["battle_tag"], fixture["username"], logging.getLogger("test"), gen=9
+    )
+    snapshots = []
+    for step in fixture["steps"]:
+        for message in step["messages"]:
+            battle.parse_message(message.split("|"))
+        battle.parse_request(step["request"])
+        snapshots += [(copy.deepcopy(battle), step["teampreview_draft"])]
+    return snapshots
+
+
+@pytest.fixture(scope="session")
+def opponent_snapshots() -> list[tuple[DoubleBattle, list[int]]]:
+    # the same battle from bob's side, which has no requests, so it is only snapshotted once bob's
+    # leads have been revealed
+    with open(fixtures / "battle.json") as f:
+        fixture = json.load(f)
+    battle = DoubleBattle(fixture["battle_tag"], "bob", logging.getLogger("test"), gen=9)
+    snapshots = []
+    for step in fixture["steps"]:
+        for message in step["messages"]:
+            battle.parse_message(message.split("|"))
+        if battle.team:
+            snapshots += [(copy.deepcopy(battle), [0, 1, 2, 3])]
+    return snapshots
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from baseline import BaselineAgent
+from poke_env.environment import DoubleBattle, Move
+from src.agent import Agent, ObservationWriter, gen_data, move_table
+from src.utils import doubles_act_len, move_pp_frac_offset
+
+
+@pytest.mark.parametrize("fake_ratings", [True, False])
+def test_embed_battle_matches_baseline(
+    snapshots: list[tuple[DoubleBattle, list[int]]], fake_ratings: bool
+):
+    for battle, teampreview_draft in snapshots:
+        expected = BaselineAgent.embed_battle(battle, teampreview_draft, fake_ratings)
+        obs = Agent.embed_battle(battle, teampreview_draft, fake_ratings)
+        assert obs.dtype == np.float32
+        np.testing.assert_array_equal(obs, expected)
+
+
+def test_observation_writer_matches_baseline(snapshots: list[tuple[DoubleBattle, list[int]]]):
+    # one writer follows the battle forwards and then backwards, so every write after the first
+    # only re-encodes what changed since the previous snapshot
+    writer = ObservationWriter()
+    for battle, teampreview_draft in snapshots + snapshots[::-1]:
+        expected = BaselineAgent.embed_battle(battle, teampreview_draft, fake_ratings=True)
+        obs = writer.write(battle, teampreview_draft, fake_ratings=True)
+        np.testing.assert_array_equal(obs, expected)
+
+
+def test_observation_writer_keeps_perspectives_apart(
+    snapshots: list[tuple[DoubleBattle, list[int]]],
+    opponent_snapshots: list[tuple[DoubleBattle, list[int]]],
+):
+    # in self-play both players' battles share a tag and the env's writer, so each side needs its
+    # own buffer
+    writer = ObservationWriter()
+    for (battle, draft), (opponent_battle, opponent_draft) in zip(
+        snapshots[-len(opponent_snapshots) :], opponent_snapshots
+    ):
+        assert battle.battle_tag == opponent_battle.battle_tag
+        obs = writer.write(battle, draft, fake_ratings=True)
+        opponent_obs = writer.write(opponent_battle, opponent_draft, fake_ratings=True)
+        np.testing.assert_array_equal(
+            obs, BaselineAgent.embed_battle(battle, draft, fake_ratings=True)
+        )
+        np.testing.assert_array_equal(
+            opponent_obs,
+            BaselineAgent.embed_battle(opponent_battle, opponent_draft, fake_ratings=True),
+        )
+
+
+@pytest.mark.parametrize("pp_used", [0, 1, 5])
+def test_move_table_matches_embed_move(pp_used: int):
+    assert move_table, "no vocabulary move was found in the generation's move data"
+    for move_id, static_embed in move_table.items():
+        move = Move(move_id, gen_data.gen)
+        move._current_pp = max(move.max_pp - pp_used, 0)
+        expected = BaselineAgent.embed_move(move).astype(np.float32)
+        np.testing.assert_array_equal(Agent.embed_move(move), expected)
+        # the table row is the baseline encoding with an empty pp fraction
+        expected[move_pp_frac_offset] = 0
+        np.testing.assert_array_equal(static_embed, expected)
+
+
+def test_embed_move_outside_vocabulary():
+    move = Move("thunderbolt", gen_data.gen)
+    assert move.id not in move_table
+    np.testing.assert_array_equal(
+        Agent.embed_move(move), BaselineAgent.embed_move(move).astype(np.float32)
+    )
+
+
+def test_action_mask_matches_baseline(snapshots: list[tuple[DoubleBattle, list[int]]]):
+    for battle, _ in snapshots:
+        action_spaces = [BaselineAgent.get_action_space(battle, pos) for pos in range(2)]
+        expected = np.concatenate([np.isin(np.arange(doubles_act_len), s) for s in action_spaces])
+        np.testing.assert_array_equal(Agent.get_action_mask(battle), expected)
+        for pos, action_space in enumerate(action_spaces):
+            np.testing.assert_array_equal(Agent.get_action_space(battle, pos), action_space)
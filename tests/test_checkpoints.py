@@ -0,0 +1,87 @@
+import os
+from typing import Any
+
+import torch
+from src.checkpoints import CheckpointRegistry, PolicyCache, SharedWeights, weights_path
+
+
+def save(registry: CheckpointRegistry, steps: int):
+    # stands in for CheckpointWriter._write, which always puts a sidecar next to the zip
+    for path in [registry.path(f"{steps}.zip"), weights_path(registry.path(f"{steps}.zip"))]:
+        with open(path, "wb") as f:
+            f.write(str(steps).encode())
+    registry.add(registry.path(f"{steps}.zip"), steps)
+
+
+def test_prune_with_fewer_than_keep_last(tmp_path: Any):
+    registry = CheckpointRegistry(str(tmp_path))
+    for steps in [0, 1]:
+        save(registry, steps)
+        registry.prune(keep_last=3)
+    assert registry.files() == ["0.zip", "1.zip"]
+    assert os.path.exists(tmp_path / "0.zip") and os.path.exists(tmp_path / "0.pt")
+
+
+def test_prune_keeps_last_and_every(tmp_path: Any):
+    registry = CheckpointRegistry(str(tmp_path))
+    save(registry, -1)
+    for steps in range(0, 1000, 100):
+        save(registry, steps)
+        registry.prune(keep_last=2, keep_every=400)
+    # pretrained initializations, multiples of keep_every and the last two are kept
+    expected = ["-1.zip", "0.zip", "400.zip", "800.zip", "900.zip"]
+    assert registry.files() == expected
+    assert sorted(f for f in os.listdir(tmp_path) if f.endswith(".zip")) == sorted(expected)
+    assert not os.path.exists(tmp_path / "500.pt")
+    registry.prune(keep_last=0)
+    assert registry.files() == ["-1.zip"]
+
+
+def test_resume_from_latest(tmp_path: Any):
+    registry = CheckpointRegistry(str(tmp_path))
+    assert registry.latest() is None
+    save(registry, -1)
+    assert registry.latest() is None
+    for steps in [100, 200]:
+        save(registry, steps)
+    # a new run over the same directory picks up where the last one stopped, and registers zips
+    # that were copied in without going through the index
+    with open(tmp_path / "300.zip", "wb") as f:
+        f.write(b"300")
+    resumed = CheckpointRegistry(str(tmp_path))
+    latest = resumed.latest()
+    assert latest is not None and latest["steps"] == 300
+    assert resumed.files() == ["-1.zip", "100.zip", "200.zip", "300.zip"]
+    save(registry, 400)
+    latest = resumed.latest()
+    assert latest is not None and latest["steps"] == 400
+
+
+def test_policy_cache_rereads_overwritten_sidecar(tmp_path: Any):
+    path = str(tmp_path / "100.zip")
+    with open(path, "wb") as f:
+        f.write(b"100")
+    cache = PolicyCache(2**20)
+    for value in [0.0, 1.0]:
+        # replaced rather than rewritten, as CheckpointWriter does
+        torch.save({"state_dict": {"w": torch.full((4,), value)}}, f"{weights_path(path)}.tmp")
+        os.replace(f"{weights_path(path)}.tmp", weights_path(path))
+        # the zip is left untouched, so only the sidecar's mtime tells the two versions apart
+        os.utime(weights_path(path), ns=(0, int(1e9 * (1 + value))))
+        assert torch.equal(cache.load(path)["w"], torch.full((4,), value))
+    assert cache.load(path) is cache.load(path)
+
+
+def test_shared_weights_round_trip():
+    state_dict = {
+        "weight": torch.randn(3, 5),
+        "empty": torch.zeros(0, 5),
+        "steps": torch.tensor(7),
+        "mask": torch.tensor([True, False, True]),
+    }
+    with SharedWeights.publish(state_dict, {"num_frames": 1}) as weights:
+        with weights.attach() as shared_state_dict:
+            assert shared_state_dict.keys() == state_dict.keys()
+            for k, v in state_dict.items():
+                assert shared_state_dict[k].dtype == v.dtype
+                assert torch.equal(shared_state_dict[k], v)
@@ -0,0 +1,168 @@
+from typing import Any
+
+import gymnasium as gym
+import numpy as np
+import pytest
+import torch
+from gymnasium.spaces import Box, MultiDiscrete
+from src import policy
+from src.policy import AttentionExtractor, MaskedActorCriticPolicy
+from src.reference import random_obs, spliced_evaluate, spliced_sample
+from src.utils import ability_ids, doubles_act_len, doubles_chunk_obs_len, item_ids, move_ids
+from stable_baselines3 import PPO
+from torch import nn
+
+
+class RandomEnv(gym.Env[np.ndarray, np.ndarray]):
+    observation_space = Box(-1, len(move_ids), (12, doubles_chunk_obs_len), np.float32)
+    action_space = MultiDiscrete([doubles_act_len, doubles_act_len])
+
+    def observe(self) -> np.ndarray:
+        obs = np.zeros((12, doubles_chunk_obs_len), dtype=np.float32)
+        illegal = self.np_random.random(2 * doubles_act_len) < 0.5
+        illegal[[0, doubles_act_len]] = False
+        obs[:, : 2 * doubles_act_len] = illegal
+        return obs
+
+    def reset(self, seed: int | None = None, options: dict[str, Any] | None = None):
+        super().reset(seed=seed)
+        return self.observe(), {}
+
+    def step(self, action: np.ndarray):
+        return (
+            self.observe(),
+            float(self.np_random.random()),
+            self.np_random.random() < 0.2,
+            False,
+            {},
+        )
+
+
+class LegacyExtractor(AttentionExtractor):
+    # parameter layout of checkpoints saved before the embedding tables were concatenated
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        del self.id_embed
+        modules = dict(self._modules)
+        self._modules.clear()
+        self.ability_embed = nn.Embedding(len(ability_ids), self.embed_len)
+        self.item_embed = nn.Embedding(len(item_ids), self.embed_len)
+        self.move_embed = nn.Embedding(len(move_ids), self.embed_len)
+        self._modules.update(modules)
+
+
+def make_ppo() -> PPO:
+    return PPO(
+        MaskedActorCriticPolicy,
+        RandomEnv(),
+        n_steps=8,
+        batch_size=8,
+        policy_kwargs={"num_frames": 1, "chooses_on_teampreview": True},
+        device="cpu",
+        seed=0,
+    )
+
+
+@pytest.mark.parametrize("deterministic", [True, False])
+def test_sampler_matches_spliced_distributions(deterministic: bool):
+    policy = make_ppo().policy
+    assert isinstance(policy, MaskedActorCriticPolicy)
+    obs, action_mask = random_obs(1024)
+    action_logits = torch.randn(len(obs), 2 * doubles_act_len)
+    actions, log_prob = policy.sample_actions(obs, action_logits, deterministic, action_mask)
+    assert action_mask.gather(1, actions + torch.tensor([0, doubles_act_len])).all()
+    if deterministic:
+        expected_actions, _ = spliced_sample(policy, obs, action_logits, True, action_mask)
+        assert torch.equal(actions, expected_actions)
+    # random draws consume the generator differently, so they are scored under the spliced
+    # distributions instead of being compared directly
+    expected_log_prob, expected_entropy = spliced_evaluate(policy, obs, action_logits, actions)
+    torch.testing.assert_close(log_prob, expected_log_prob)
+    log_prob, entropy = policy.evaluate_log_probs(obs, action_logits, actions.float())
+    torch.testing.assert_close(log_prob, expected_log_prob)
+    torch.testing.assert_close(entropy, expected_entropy)
+
+
+def test_evaluate_log_probs_gradients():
+    policy = make_ppo().policy
+    assert isinstance(policy, MaskedActorCriticPolicy)
+    obs, action_mask = random_obs(256)
+    action_logits = torch.randn(len(obs), 2 * doubles_act_len)
+    actions, _ = policy.sample_actions(obs, action_logits, action_mask=action_mask)
+    # the PPO loss backpropagates through both the log-probs and the entropy, including through
+    # the masked slots
+    logits = action_logits.clone().requires_grad_()
+    log_prob, entropy = policy.evaluate_log_probs(obs, logits, actions.float())
+    (log_prob.mean() - entropy.mean()).backward()
+    expected_logits = action_logits.clone().requires_grad_()
+    expected_log_prob, expected_entropy = spliced_evaluate(policy, obs, expected_logits, actions)
+    (expected_log_prob.mean() - expected_entropy.mean()).backward()
+    assert logits.grad is not None and expected_logits.grad is not None
+    assert torch.isfinite(logits.grad).all()
+    torch.testing.assert_close(logits.grad, expected_logits.grad)
+
+
+def test_learn_keeps_parameters_finite():
+    ppo = make_ppo()
+    ppo.learn(32)
+    assert all(torch.isfinite(p).all() for p in ppo.policy.parameters())
+
+
+def test_incremental_matches_full_recompute():
+    num_frames = 4
+    policy = MaskedActorCriticPolicy(
+        Box(-1, len(move_ids), (num_frames, 12, doubles_chunk_obs_len), np.float32),
+        RandomEnv.action_space,
+        lambda _: 0,
+        num_frames=num_frames,
+        chooses_on_teampreview=True,
+    ).eval()
+    extractor = policy.pi_features_extractor
+    assert isinstance(extractor, AttentionExtractor)
+    # two streams that start two steps apart, so the batch mixes cache hits and misses
+    frames = random_obs(2 * 8)[0].view(2, 8, 12, doubles_chunk_obs_len)
+    frames = torch.cat([torch.zeros(2, num_frames - 1, *frames.shape[2:]), frames], dim=1)
+    with torch.no_grad():
+        for t in range(8):
+            streams = [0] if t < 2 else [0, 1]
+            obs = torch.stack([frames[s, t - 2 * s : t - 2 * s + num_frames] for s in streams])
+            with policy.incremental([f"stream-{s}" for s in streams]):
+                features = extractor(obs)
+            assert extractor.cache_keys is None
+            torch.testing.assert_close(features, extractor(obs))
+    policy.evict_stream("stream-0")
+    assert list(extractor.frame_cache) == ["stream-1"]
+
+
+def test_load_legacy_checkpoint(monkeypatch: pytest.MonkeyPatch, tmp_path: Any):
+    with monkeypatch.context() as m:
+        m.setattr(policy, "AttentionExtractor", LegacyExtractor)
+        legacy = make_ppo()
+    # one optimizer step, so that every parameter has Adam moments to convert
+    for p in legacy.policy.parameters():
+        p.grad = torch.randn_like(p)
+    legacy.policy.optimizer.step()
+    legacy.save(tmp_path / "legacy.zip")
+    ppo = PPO.load(tmp_path / "legacy.zip", device="cpu")
+    for legacy_extractor, extractor in [
+        (legacy.policy.pi_features_extractor, ppo.policy.pi_features_extractor),
+        (legacy.policy.vf_features_extractor, ppo.policy.vf_features_extractor),
+    ]:
+        tables = [
+            legacy_extractor.ability_embed.weight,
+            legacy_extractor.item_embed.weight,
+            legacy_extractor.move_embed.weight,
+        ]
+        assert torch.equal(extractor.id_embed.weight, torch.cat(tables))
+        legacy_states = [legacy.policy.optimizer.state[t] for t in tables]
+        state = ppo.policy.optimizer.state[extractor.id_embed.weight]
+        for k in ["exp_avg", "exp_avg_sq"]:
+            assert torch.equal(state[k], torch.cat([s[k] for s in legacy_states]))
+    legacy_params = dict(legacy.policy.named_parameters())
+    for name, p in ppo.policy.named_parameters():
+        if "id_embed" not in name:
+            legacy_state = legacy.policy.optimizer.state[legacy_params[name]]
+            assert torch.equal(p, legacy_params[name])
+            assert torch.equal(ppo.policy.optimizer.state[p]["exp_avg"], legacy_state["exp_avg"])
+    ppo.set_env(RandomEnv())
+    ppo.learn(16)
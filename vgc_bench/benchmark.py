@@ -0,0 +1,486 @@
+import argparse
+import asyncio
+import copy
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from typing import Any, Callable
+
+import numpy as np
+import torch
+from gymnasium.spaces import Box, MultiDiscrete
+from poke_env.environment import AbstractBattle, DoubleBattle
+from poke_env.player import BattleOrder
+from poke_env.ps_client import AccountConfiguration
+from stable_baselines3 import PPO
+
+from vgc_bench.logs2trajs import LogReader
+from vgc_bench.scrape_logs import battle_formats
+from vgc_bench.src.agent import Agent, ObservationWriter
+from vgc_bench.src.policy import MaskedActorCriticPolicy
+from vgc_bench.src.reference import random_obs, spliced_evaluate, spliced_sample
+from vgc_bench.src.utils import (
+    abilities,
+    doubles_act_len,
+    doubles_chunk_obs_len,
+    get_ability_id,
+    get_item_id,
+    get_move_id,
+    items,
+    moves,
+)
+
+
+class BattleRecorder(LogReader):
+    snapshots: list[tuple[DoubleBattle, list[int]]]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.snapshots = []
+
+    def choose_move(self, battle: AbstractBattle) -> BattleOrder:
+        order = super().choose_move(battle)
+        assert isinstance(battle, DoubleBattle)
+        self.snapshots += [(copy.deepcopy(battle), list(self.teampreview_draft))]
+        return order
+
+    def teampreview(self, battle: AbstractBattle) -> str:
+        teampreview_draft = list(self.teampreview_draft)
+        message = super().teampreview(battle)
+        assert isinstance(battle, DoubleBattle)
+        self.snapshots += [(copy.deepcopy(battle), teampreview_draft)]
+        return message
+
+
+def record_battles(num_logs: int) -> list[tuple[DoubleBattle, list[int]]]:
+    logs = {}
+    for f in battle_formats:
+        try:
+            with open(f"data/logs-{f}.json", "r") as file:
+                logs = {**logs, **json.load(file)}
+        except FileNotFoundError:
+            continue
+    snapshots = []
+    for tag, (_, log) in list(logs.items())[:num_logs]:
+        start_index = log.index("|player|p1|")
+        username = log[start_index : log.index("\n", start_index)].split("|")[3]
+        recorder = BattleRecorder(
+            account_configuration=AccountConfiguration(username, None),
+            battle_format=tag.split("-")[0],
+            log_level=51,
+            accept_open_team_sheet=True,
+        )
+        try:
+            asyncio.run(recorder.follow_log(tag, log))
+        except Exception:
+            continue
+        snapshots += recorder.snapshots
+    assert len(snapshots) > 0, "no battles could be recorded from data/logs-*.json"
+    return snapshots
+
+
+def bench_lookups(snapshots: list[tuple[DoubleBattle, list[int]]], repeats: int):
+    pokemons = [
+        p
+        for battle, _ in snapshots
+        for p in [*battle.team.values(), *battle.opponent_team.values()]
+    ]
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for p in pokemons:
+            abilities.index("null" if p.ability is None else p.ability)
+            items.index("null" if p.item is None else p.item)
+            for move in p.moves.values():
+                moves.index("hiddenpower" if move.id.startswith("hiddenpower") else move.id)
+    list_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for p in pokemons:
+            get_ability_id(p.ability)
+            get_item_id(p.item)
+            for move in p.moves.values():
+                get_move_id(move.id)
+    dict_time = time.perf_counter() - start
+    n = repeats * len(pokemons)
+    print(f"id lookups (list.index): {n / list_time:.0f} pokemon/sec")
+    print(f"id lookups (hashed maps): {n / dict_time:.0f} pokemon/sec")
+
+
+def bench_embed(snapshots: list[tuple[DoubleBattle, list[int]]], repeats: int):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for battle, teampreview_draft in snapshots:
+            Agent.embed_battle(battle, teampreview_draft, fake_ratings=True)
+    duration = time.perf_counter() - start
+    print(f"Agent.embed_battle: {repeats * len(snapshots) / duration:.0f} calls/sec")
+    writer = ObservationWriter()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for battle, teampreview_draft in snapshots:
+            writer.write(battle, teampreview_draft, fake_ratings=True)
+    duration = time.perf_counter() - start
+    print(f"ObservationWriter.write: {repeats * len(snapshots) / duration:.0f} calls/sec")
+
+
+def check_parity(snapshots: list[tuple[DoubleBattle, list[int]]]):
+    writer = ObservationWriter()
+    for battle, teampreview_draft in snapshots:
+        expected = Agent.embed_battle(battle, teampreview_draft, fake_ratings=True)
+        obs = writer.write(battle, teampreview_draft, fake_ratings=True)
+        assert np.array_equal(obs, expected), f"ObservationWriter mismatch: {battle.battle_tag}"
+        if battle._last_request:
+            action_mask = np.zeros((2, doubles_act_len), dtype=np.bool_)
+            for pos in range(2):
+                action_mask[pos, Agent.get_action_space(battle, pos).astype(np.int64)] = True
+            assert np.array_equal(
+                Agent.get_action_mask(battle), action_mask.reshape(-1)
+            ), f"get_action_mask mismatch: {battle.battle_tag}"
+    print(f"fast encoders match the reference encoders on {len(snapshots)} battle states")
+
+
+def make_policy(num_frames: int = 1) -> MaskedActorCriticPolicy:
+    shape = (
+        (12, doubles_chunk_obs_len) if num_frames == 1 else (num_frames, 12, doubles_chunk_obs_len)
+    )
+    policy = MaskedActorCriticPolicy(
+        Box(-1, len(moves), shape=shape, dtype=np.float32),
+        MultiDiscrete([doubles_act_len, doubles_act_len]),
+        lambda _: 1e-4,
+        num_frames=num_frames,
+        chooses_on_teampreview=True,
+    )
+    return policy.eval()
+
+
+def check_sampler_parity(batch_size: int = 1024):
+    policy = make_policy()
+    obs, action_mask = random_obs(batch_size)
+    action_logits = torch.randn(batch_size, 2 * doubles_act_len)
+    # greedy draws must agree exactly; random draws consume the generator differently, so they are
+    # checked by scoring the fused sampler's actions under the spliced distributions
+    expected_actions, _ = spliced_sample(policy, obs, action_logits, True, action_mask)
+    actions, _ = policy.sample_actions(obs, action_logits, True, action_mask)
+    assert torch.equal(actions, expected_actions), "sample_actions greedy actions differ"
+    for deterministic in [True, False]:
+        actions, log_prob = policy.sample_actions(obs, action_logits, deterministic, action_mask)
+        expected_log_prob, expected_entropy = spliced_evaluate(policy, obs, action_logits, actions)
+        assert torch.allclose(log_prob, expected_log_prob, atol=1e-5), "sample_actions log-probs"
+        log_prob, entropy = policy.evaluate_log_probs(obs, action_logits, actions.float())
+        assert torch.allclose(
+            log_prob, expected_log_prob, atol=1e-5
+        ), "evaluate_log_probs log-probs"
+        assert torch.allclose(entropy, expected_entropy, atol=1e-5), "evaluate_log_probs entropy"
+    # the PPO loss backpropagates through both the log-probs and the entropy, so their gradients
+    # (including those flowing through masked slots) have to match as well
+    logits = action_logits.clone().requires_grad_()
+    log_prob, entropy = policy.evaluate_log_probs(obs, logits, actions.float())
+    (log_prob.mean() - entropy.mean()).backward()
+    expected_logits = action_logits.clone().requires_grad_()
+    expected_log_prob, expected_entropy = spliced_evaluate(policy, obs, expected_logits, actions)
+    (expected_log_prob.mean() - expected_entropy.mean()).backward()
+    assert logits.grad is not None and expected_logits.grad is not None
+    assert torch.isfinite(logits.grad).all(), "evaluate_log_probs gradients are not finite"
+    assert torch.allclose(logits.grad, expected_logits.grad, atol=1e-6), "logit gradients differ"
+    values, log_prob, entropy = policy.evaluate_actions(obs, actions.float())
+    assert entropy is not None
+    (values.mean() - log_prob.mean() - entropy.mean()).backward()
+    assert all(
+        p.grad is None or torch.isfinite(p.grad).all() for p in policy.parameters()
+    ), "evaluate_actions parameter gradients are not finite"
+    print(f"fused two-head sampler matches the spliced distributions on {batch_size} samples")
+
+
+def bench_sampler(repeats: int):
+    policy = make_policy()
+    for batch_size in [1, 48, 1024]:
+        obs, action_mask = random_obs(batch_size)
+        action_logits = torch.randn(batch_size, 2 * doubles_act_len)
+        actions, _ = policy.sample_actions(obs, action_logits, action_mask=action_mask)
+        runs = {
+            "spliced sample": lambda: spliced_sample(
+                policy, obs, action_logits, False, action_mask
+            ),
+            "fused sample": lambda: policy.sample_actions(
+                obs, action_logits, action_mask=action_mask
+            ),
+            "spliced evaluate": lambda: spliced_evaluate(policy, obs, action_logits, actions),
+            "fused evaluate": lambda: policy.evaluate_log_probs(obs, action_logits, actions),
+        }
+        with torch.no_grad():
+            for name, run in runs.items():
+                start = time.perf_counter()
+                for _ in range(100 * repeats):
+                    run()
+                duration = time.perf_counter() - start
+                print(
+                    f"{name} (batch size {batch_size}): "
+                    f"{100 * repeats * batch_size / duration:.0f} samples/sec"
+                )
+
+
+def bench_compiled(repeats: int):
+    eager_policy = make_policy()
+    compiled_policy = make_policy()
+    compiled_policy.load_state_dict(eager_policy.state_dict())
+    compiled_policy.compile_inference()
+    for batch_size in [1, 10, 48]:
+        obs, action_mask = random_obs(batch_size)
+        with torch.no_grad():
+            # the first calls trigger compilation for this batch size
+            for _ in range(3):
+                compiled_policy.forward(obs, action_mask=action_mask)
+            for name, policy in [("eager", eager_policy), ("compiled", compiled_policy)]:
+                start = time.perf_counter()
+                for _ in range(10 * repeats):
+                    policy.forward(obs, action_mask=action_mask)
+                duration = time.perf_counter() - start
+                print(
+                    f"{name} policy forward (batch size {batch_size}): "
+                    f"{10 * repeats * batch_size / duration:.0f} decisions/sec"
+                )
+
+
+def check_quantized(
+    snapshots: list[tuple[DoubleBattle, list[int]]], policy: MaskedActorCriticPolicy, repeats: int
+):
+    obs = np.stack([Agent.embed_battle(b, d, True) for b, d in snapshots])
+    if policy.num_frames > 1:
+        padding = np.zeros((len(obs), policy.num_frames - 1, *obs.shape[1:]), dtype=np.float32)
+        obs = np.concatenate([padding, obs[:, None]], axis=1)
+    action_masks = np.stack(
+        [
+            Agent.get_action_mask(b) if b._last_request else np.ones(2 * doubles_act_len, bool)
+            for b, _ in snapshots
+        ]
+    )
+    policy = policy.cpu()
+    quantized_policy = policy.quantize_inference()
+    obs_tensor = torch.as_tensor(obs)
+    mask_tensor = torch.as_tensor(action_masks)
+    with torch.no_grad():
+        actions = policy.forward(obs_tensor, deterministic=True, action_mask=mask_tensor)[0]
+        quantized_actions = quantized_policy.forward(
+            obs_tensor, deterministic=True, action_mask=mask_tensor
+        )[0]
+        agreement = (actions == quantized_actions).float().mean(dim=0).tolist()
+        joint_agreement = (actions == quantized_actions).all(dim=1).float().mean().item()
+        print(
+            f"int8 vs fp32 greedy action agreement on {len(obs)} recorded states: "
+            f"slot 1 {agreement[0]:.3f}, slot 2 {agreement[1]:.3f}, joint {joint_agreement:.3f}"
+        )
+        for batch_size in [1, 48]:
+            for name, p in [("fp32", policy), ("int8", quantized_policy)]:
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    for i in range(0, len(obs) - batch_size + 1, batch_size):
+                        p.forward(
+                            obs_tensor[i : i + batch_size],
+                            action_mask=mask_tensor[i : i + batch_size],
+                        )
+                duration = time.perf_counter() - start
+                n = repeats * (len(obs) // batch_size) * batch_size
+                print(
+                    f"{name} policy forward (batch size {batch_size}): {n / duration:.0f} decisions/sec"
+                )
+    for name, p in [("fp32", policy), ("int8", quantized_policy)]:
+        buffer = io.BytesIO()
+        torch.save(p.state_dict(), buffer)
+        print(f"{name} policy state_dict: {buffer.tell() / 1e6:.2f} MB")
+
+
+def recorded_obs(
+    snapshots: list[tuple[DoubleBattle, list[int]]], batch_size: int, num_frames: int
+) -> tuple[torch.Tensor, torch.Tensor]:
+    # recorded states are tiled up to the batch size and stacked behind empty frames, as at turn 0
+    indices = np.arange(batch_size) % len(snapshots)
+    battles = [snapshots[i][0] for i in indices]
+    obs = np.stack([Agent.embed_battle(*snapshots[i], True) for i in indices])
+    if num_frames > 1:
+        padding = np.zeros((len(obs), num_frames - 1, *obs.shape[1:]), dtype=np.float32)
+        obs = np.concatenate([padding, obs[:, None]], axis=1)
+    action_mask = np.stack(
+        [
+            Agent.get_action_mask(b) if b._last_request else np.ones(2 * doubles_act_len, bool)
+            for b in battles
+        ]
+    )
+    return torch.as_tensor(obs), torch.as_tensor(action_mask)
+
+
+def time_op(run: Callable[[], Any], repeats: int, min_time: float) -> float:
+    # median seconds per call, after one warm-up call
+    run()
+    durations = []
+    start = time.perf_counter()
+    while len(durations) < repeats or time.perf_counter() - start < min_time:
+        call_start = time.perf_counter()
+        run()
+        durations += [time.perf_counter() - call_start]
+    return statistics.median(durations)
+
+
+def bench_ops(
+    policy: MaskedActorCriticPolicy,
+    obs: torch.Tensor,
+    action_mask: torch.Tensor,
+    repeats: int,
+    min_time: float,
+) -> dict[str, float]:
+    with torch.no_grad():
+        actions = policy.forward(obs, action_mask=action_mask)[0].float()
+    # evaluate_actions runs with autograd enabled, as it does in PPO.train
+    runs: dict[str, tuple[Callable[[], Any], bool]] = {
+        "forward": (lambda: policy.forward(obs, action_mask=action_mask), False),
+        "evaluate_actions": (lambda: policy.evaluate_actions(obs, actions), True),
+        "get_mask": (lambda: policy.get_mask(obs, action_mask=action_mask), False),
+        "extractor": (lambda: policy.pi_features_extractor(obs), False),
+    }
+    timings = {}
+    for name, (run, grad) in runs.items():
+        with torch.set_grad_enabled(grad):
+            timings[name] = time_op(run, repeats, min_time)
+    return timings
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_policy(
+    batch_sizes: list[int],
+    frame_counts: list[int],
+    thread_counts: list[int],
+    repeats: int,
+    min_time: float,
+    num_logs: int,
+    out: str,
+):
+    snapshots = record_battles(num_logs) if num_logs > 0 else None
+    results = []
+    for num_frames in frame_counts:
+        policy = make_policy(num_frames)
+        for batch_size in batch_sizes:
+            if snapshots is None:
+                obs, action_mask = random_obs(batch_size, num_frames)
+            else:
+                obs, action_mask = recorded_obs(snapshots, batch_size, num_frames)
+            for num_threads in thread_counts:
+                torch.set_num_threads(num_threads)
+                timings = bench_ops(policy, obs, action_mask, repeats, min_time)
+                for op, seconds in timings.items():
+                    results += [
+                        {
+                            "op": op,
+                            "batch_size": batch_size,
+                            "num_frames": num_frames,
+                            "num_threads": num_threads,
+                            "ms": 1e3 * seconds,
+                            "samples_per_sec": batch_size / seconds,
+                        }
+                    ]
+                    print(
+                        f"{op} (batch size {batch_size}, {num_frames} frames, "
+                        f"{num_threads} threads): {1e3 * seconds:.2f} ms, "
+                        f"{batch_size / seconds:.0f} samples/sec"
+                    )
+    report = {
+        "commit": git_commit(),
+        "torch": torch.__version__,
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "inputs": "synthetic" if snapshots is None else f"{len(snapshots)} recorded states",
+        "results": results,
+    }
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {len(results)} timings to {out}")
+
+
+def run_suite(num_logs: int, repeats: int, policy_file: str | None):
+    check_sampler_parity()
+    bench_sampler(repeats)
+    bench_compiled(repeats)
+    snapshots = record_battles(num_logs)
+    print(f"recorded {len(snapshots)} battle states")
+    check_parity(snapshots)
+    bench_lookups(snapshots, repeats)
+    bench_embed(snapshots, repeats)
+    policy = make_policy() if policy_file is None else PPO.load(policy_file, device="cpu").policy
+    assert isinstance(policy, MaskedActorCriticPolicy)
+    check_quantized(snapshots, policy, repeats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark observation encoding, action sampling and policy inference"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    suite_parser = subparsers.add_parser(
+        "suite", help="Check the fast encoders and samplers against their references and time them"
+    )
+    suite_parser.add_argument("--num_logs", type=int, default=50, help="Number of logs to replay")
+    suite_parser.add_argument(
+        "--repeats", type=int, default=10, help="Passes over the recorded battles"
+    )
+    suite_parser.add_argument(
+        "--policy_file",
+        type=str,
+        default=None,
+        help="Saved PPO model for the int8 accuracy check. Default is an untrained policy.",
+    )
+    policy_parser = subparsers.add_parser(
+        "policy",
+        help="Time policy inference across batch sizes, frame stacks and thread counts (CPU only)",
+    )
+    policy_parser.add_argument(
+        "--batch_sizes",
+        type=int,
+        nargs="+",
+        default=[1, 16, 64, 256, 1024, 4096],
+        help="Batch sizes to time",
+    )
+    policy_parser.add_argument(
+        "--num_frames", type=int, nargs="+", default=[1, 3, 5], help="Frame stack sizes to time"
+    )
+    policy_parser.add_argument(
+        "--threads",
+        type=int,
+        nargs="+",
+        default=[1, torch.get_num_threads()],
+        help="CPU thread counts to time",
+    )
+    policy_parser.add_argument("--repeats", type=int, default=5, help="Minimum timed calls per op")
+    policy_parser.add_argument(
+        "--min_time", type=float, default=0.5, help="Minimum seconds spent timing each op"
+    )
+    policy_parser.add_argument(
+        "--num_logs",
+        type=int,
+        default=0,
+        help="Replay this many scraped logs for recorded observations. Default is synthetic.",
+    )
+    policy_parser.add_argument(
+        "--out", type=str, default="bench_policy.json", help="JSON results file"
+    )
+    args = parser.parse_args()
+    if args.command == "suite":
+        run_suite(args.num_logs, args.repeats, args.policy_file)
+    else:
+        bench_policy(
+            args.batch_sizes,
+            args.num_frames,
+            sorted(set(args.threads)),
+            args.repeats,
+            args.min_time,
+            args.num_logs,
+            args.out,
+        )
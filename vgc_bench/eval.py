@@ -6,7 +6,7 @@ import torch
 from poke_env import cross_evaluate
 from poke_env.player import MaxBasePowerPlayer, RandomPlayer, SimpleHeuristicsPlayer
 from poke_env.ps_client import AccountConfiguration, ServerConfiguration
-from src.agent import Agent
+from src.agent import Agent, InferenceServer
 from src.llm import LLMPlayer
 from src.teams import RandomTeamBuilder
 from src.utils import battle_format
@@ -48,6 +48,7 @@ def eval(teams: list[int], port: int):
         # "bc10": f"results/saves-bc-fp/0,1,2,3,4,5,6,7,8,9-teams/98304",
         # "bc30": f"results/saves-bc-fp/0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23,24,25,26,27,28,29-teams/98304",
     }
+    inference_server = InferenceServer()
     for name, f in agent_files.items():
         agent = Agent(
             num_frames=1,
@@ -63,6 +64,7 @@ def eval(teams: list[int], port: int):
             accept_open_team_sheet=True,
             open_timeout=None,
             team=RandomTeamBuilder(teams, battle_format),
+            inference_server=inference_server,
         )
         agent.set_policy(PPO.load(f).policy)
         players += [agent]
@@ -12,7 +12,7 @@ from poke_env.player import BattleOrder, DoubleBattleOrder, DoublesEnv, Player
 from poke_env.ps_client import AccountConfiguration
 from vgc_bench.scrape_logs import battle_formats
 from vgc_bench.src.agent import Agent
-from vgc_bench.src.utils import doubles_chunk_obs_len
+from vgc_bench.src.utils import doubles_chunk_obs_len, obs_dtype
 
 MIN_RATING = 1200
 
@@ -144,7 +144,7 @@ class LogReader(Player):
         await self._handle_battle_message(split_messages)
         last_state = Agent.embed_battle(self.battles[tag], self.teampreview_draft)
         self.states += [last_state]
-        return np.stack(self.states, axis=0), np.stack(self.actions, axis=0)
+        return np.stack(self.states, axis=0).astype(obs_dtype), np.stack(self.actions, axis=0)
 
 
 def process_logs(log_jsons: dict[str, tuple[str, str]], strict: bool = False) -> list[Trajectory]:
@@ -3,7 +3,7 @@ import asyncio
 
 import torch
 from poke_env import AccountConfiguration, ShowdownServerConfiguration
-from src.agent import Agent
+from src.agent import Agent, InferenceServer
 from src.teams import RandomTeamBuilder
 from src.utils import battle_format
 from stable_baselines3 import PPO
@@ -22,6 +22,7 @@ async def play(filepath: str, n_games: int, play_on_ladder: bool):
         accept_open_team_sheet=True,
         start_timer_on_battle_start=play_on_ladder,
         team=RandomTeamBuilder([0], battle_format),
+        inference_server=InferenceServer(),
     )
     agent.set_policy(PPO.load(filepath).policy)
     if play_on_ladder:
@@ -5,16 +5,17 @@ import pickle
 import numpy as np
 import torch
 from imitation.algorithms.bc import BC
-from imitation.data.types import Trajectory
+from imitation.data.types import DictObs, Trajectory
 from imitation.util.logger import configure
 from poke_env.player import MaxBasePowerPlayer, RandomPlayer, SingleAgentWrapper
 from poke_env.ps_client import AccountConfiguration, ServerConfiguration
-from vgc_bench.src.agent import Agent
+from vgc_bench.src.agent import Agent, InferenceServer, ObservationWriter
 from vgc_bench.src.callback import Callback
+from vgc_bench.src.checkpoints import CheckpointRegistry, CheckpointWriter
 from vgc_bench.src.env import ShowdownEnv
 from vgc_bench.src.policy import MaskedActorCriticPolicy
 from vgc_bench.src.teams import RandomTeamBuilder
-from vgc_bench.src.utils import LearningStyle, battle_format
+from vgc_bench.src.utils import LearningStyle, battle_format, compact_obs, obs_dtype
 from stable_baselines3 import PPO
 from torch.utils.data import DataLoader, Dataset
 
@@ -34,8 +35,16 @@ class TrajectoryDataset(Dataset):
         file_path = self.files[idx]
         with open(file_path, "rb") as f:
             traj = pickle.load(f)
+        if traj.obs.dtype != obs_dtype:
+            traj = Trajectory(
+                obs=traj.obs.astype(obs_dtype), acts=traj.acts, infos=None, terminal=True
+            )
         if self.num_frames > 1:
             traj = self._frame_stack_traj(traj)
+        if compact_obs:
+            # trajectories are stored densely, so they are converted to the env's compact layout
+            obs = ObservationWriter.to_compact(traj.obs, obs_dtype)
+            traj = Trajectory(obs=DictObs(obs), acts=traj.acts, infos=None, terminal=True)
         return traj
 
     def _frame_stack_traj(self, traj: Trajectory) -> Trajectory:
@@ -52,7 +61,14 @@ class TrajectoryDataset(Dataset):
         return Trajectory(obs=stacked_obs, acts=traj.acts, infos=None, terminal=True)
 
 
-def pretrain(num_teams: int, port: int, device: str, num_frames: int):
+def pretrain(
+    num_teams: int,
+    port: int,
+    device: str,
+    num_frames: int,
+    keep_last: int | None,
+    keep_every: int | None,
+):
     env = ShowdownEnv(
         learning_style=LearningStyle.PURE_SELF_PLAY,
         battle_format=battle_format,
@@ -105,6 +121,7 @@ def pretrain(num_teams: int, port: int, device: str, num_frames: int):
         log_level=40,
         accept_open_team_sheet=True,
         team=RandomTeamBuilder(list(range(num_teams)), battle_format),
+        inference_server=InferenceServer(),
     )
     eval_opponent = MaxBasePowerPlayer(
         account_configuration=AccountConfiguration.randgen(10),
@@ -121,7 +138,9 @@ def pretrain(num_teams: int, port: int, device: str, num_frames: int):
     eval_agent.set_policy(policy)
     win_rate = Callback.compare(eval_agent, eval_opponent, 100)
     bc.logger.record("bc/eval", win_rate)
-    ppo.save(f"results/saves-bc{f'-fs{num_frames}' if num_frames > 1 else ''}/0")
+    registry = CheckpointRegistry(f"results/saves-bc{f'-fs{num_frames}' if num_frames > 1 else ''}")
+    checkpoint_writer = CheckpointWriter(registry, keep_last, keep_every)
+    checkpoint_writer.save(ppo, 0)
     for i in range(1000):
         data = iter(dataloader)
         for _ in range(div_count):
@@ -132,7 +151,8 @@ def pretrain(num_teams: int, port: int, device: str, num_frames: int):
         eval_agent.set_policy(policy)
         win_rate = Callback.compare(eval_agent, eval_opponent, 100)
         bc.logger.record("bc/eval", win_rate)
-        ppo.save(f"results/saves-bc{f'-fs{num_frames}' if num_frames > 1 else ''}/{i + 1}")
+        checkpoint_writer.save(ppo, i + 1)
+    checkpoint_writer.close()
 
 
 if __name__ == "__main__":
@@ -152,5 +172,19 @@ if __name__ == "__main__":
         default=1,
         help="number of frames to use for frame stacking. default is 1",
     )
+    parser.add_argument(
+        "--keep_last",
+        type=int,
+        default=None,
+        help="Only keep the last this many epoch checkpoints. Default keeps all of them.",
+    )
+    parser.add_argument(
+        "--keep_every",
+        type=int,
+        default=None,
+        help="With --keep_last, also keep every checkpoint whose epoch is a multiple of this",
+    )
     args = parser.parse_args()
-    pretrain(args.num_teams, args.port, args.device, args.num_frames)
+    pretrain(
+        args.num_teams, args.port, args.device, args.num_frames, args.keep_last, args.keep_every
+    )
@@ -1,74 +1,561 @@
+import asyncio
 import random
-from typing import Any, Deque
+from contextlib import nullcontext
+from typing import Any, Awaitable
 
 import numpy as np
 import numpy.typing as npt
 import torch
-from poke_env.environment import (
-    AbstractBattle,
-    Battle,
-    DoubleBattle,
-    Effect,
-    Field,
-    Move,
-    MoveCategory,
-    Pokemon,
-    PokemonGender,
-    PokemonType,
-    SideCondition,
-    Status,
-    Target,
-    Weather,
-)
+from gymnasium.spaces import Dict
+from poke_env.data import GenData
+from poke_env.environment import AbstractBattle, Battle, DoubleBattle, Move, Pokemon, SideCondition
 from poke_env.player import BattleOrder, DoublesEnv, Player, SinglesEnv
 from poke_env.player.env import _EnvPlayer
+from src.encoders import (
+    effect_encoder,
+    field_encoder,
+    gender_encoder,
+    move_category_encoder,
+    pokemon_type_encoder,
+    side_condition_encoder,
+    status_encoder,
+    target_encoder,
+    weather_encoder,
+)
+from src.policy import MaskedActorCriticPolicy
 from src.utils import (
-    abilities,
+    battle_format,
+    compile_inference,
     doubles_act_len,
     doubles_chunk_obs_len,
-    items,
+    doubles_field_offset,
+    doubles_flag_offset,
+    doubles_pokemon_offset,
+    doubles_side_offset,
+    doubles_weather_offset,
+    get_ability_id,
+    get_item_id,
+    get_move_id,
     move_obs_len,
+    move_pp_frac_offset,
     moves,
+    pokemon_boost_offset,
+    pokemon_effect_offset,
+    pokemon_flag_offset,
+    pokemon_gender_offset,
+    pokemon_move_offset,
     pokemon_obs_len,
+    pokemon_stat_offset,
+    pokemon_status_offset,
+    pokemon_type_offset,
+    pokemon_volatile_offset,
+    quantize_inference,
     singles_act_len,
 )
 from stable_baselines3.common.policies import ActorCriticPolicy
 
+gen_data = GenData.from_format(battle_format)
+
+
+def embed_static_move(move: Move) -> npt.NDArray[np.float32]:
+    power = move.base_power / 250
+    acc = move.accuracy / 100
+    category = move_category_encoder.encode([move.category])
+    target = target_encoder.encode([move.target])
+    priority = (move.priority + 7) / 12
+    crit_ratio = move.crit_ratio
+    drain = move.drain
+    force_switch = float(move.force_switch)
+    recoil = move.recoil
+    self_destruct = float(move.self_destruct is not None)
+    self_switch = float(move.self_switch is not False)
+    pp = move.max_pp / 64
+    move_type = pokemon_type_encoder.encode([move.type])
+    return np.concatenate(
+        [
+            [power, acc],
+            category,
+            target,
+            [
+                priority,
+                crit_ratio,
+                drain,
+                force_switch,
+                recoil,
+                self_destruct,
+                self_switch,
+                pp,
+                0,  # pp fraction, filled in by embed_move
+            ],
+            move_type,
+        ],
+        dtype=np.float32,
+    )
+
+
+# static move features (everything except the pp fraction), built once for every known move
+move_table = {m: embed_static_move(Move(m, gen_data.gen)) for m in moves if m in gen_data.moves}
+
+
+def get_static_move(move: Move) -> npt.NDArray[np.float32]:
+    # moves outside the vocabulary are embedded on first use and kept in the table
+    if move.id not in move_table:
+        move_table[move.id] = embed_static_move(move)
+    return move_table[move.id]
+
+
+class ObservationWriter:
+    # keyed by battle tag and side, since both players of a self-play battle share one writer
+    _buffers: dict[tuple[str, str | None], npt.NDArray[np.float32]]
+    _stable_keys: dict[tuple[str, str | None], list[tuple[Any, ...] | None]]
+
+    def __init__(self):
+        self._buffers = {}
+        self._stable_keys = {}
+
+    def write(
+        self,
+        battle: DoubleBattle,
+        teampreview_draft: list[int],
+        fake_ratings: bool = False,
+        action_mask: npt.NDArray[np.bool_] | None = None,
+    ) -> npt.NDArray[np.float32]:
+        # the returned array is reused on the battle's next write, so copy it if it must be kept
+        # if given, action_mask is filled with the legal actions of both slots (True = legal)
+        key = (battle.battle_tag, battle.player_role)
+        stable_keys: list[tuple[Any, ...] | None] | None
+        if battle.finished:
+            buffer = self._buffers.pop(key, None)
+            stable_keys = self._stable_keys.pop(key, None)
+        else:
+            buffer = self._buffers.get(key)
+            stable_keys = self._stable_keys.get(key)
+        if buffer is None or stable_keys is None:
+            buffer = np.zeros((12, doubles_chunk_obs_len), dtype=np.float32)
+            stable_keys = [None for _ in range(12)]
+            if not battle.finished:
+                self._buffers[key] = buffer
+                self._stable_keys[key] = stable_keys
+        assert battle.teampreview == (len(teampreview_draft) < 4)
+        assert all([0 <= i < 6 for i in teampreview_draft])
+        buffer[:, :doubles_pokemon_offset] = 0
+        ObservationWriter.write_global(buffer[0, :doubles_side_offset], battle, action_mask)
+        buffer[1:, :doubles_side_offset] = buffer[0, :doubles_side_offset]
+        side = slice(doubles_side_offset, doubles_pokemon_offset)
+        ObservationWriter.write_side(buffer[0, side], battle, fake_ratings)
+        buffer[1:6, side] = buffer[0, side]
+        ObservationWriter.write_side(buffer[6, side], battle, fake_ratings, opp=True)
+        buffer[7:, side] = buffer[6, side]
+        sides = [
+            (list(battle.team.values()), battle.active_pokemon),
+            (list(battle.opponent_team.values()), battle.opponent_active_pokemon),
+        ]
+        for j, (team, (active_a, active_b)) in enumerate(sides):
+            for pos in range(6):
+                i = 6 * j + pos
+                out = buffer[i, doubles_pokemon_offset:]
+                if pos >= len(team):
+                    if stable_keys[i] is not None:
+                        out[:] = 0
+                        stable_keys[i] = None
+                    continue
+                p = team[pos]
+                # only rewrite the stable fields of a pokemon when something they encode changed
+                stable_key = ObservationWriter.get_stable_key(p)
+                if stable_key != stable_keys[i]:
+                    out[:] = 0
+                    ObservationWriter.write_stable_pokemon(out, p)
+                    stable_keys[i] = stable_key
+                else:
+                    out[pokemon_volatile_offset:] = 0
+                ObservationWriter.write_volatile_pokemon(
+                    out,
+                    p,
+                    pos,
+                    from_opponent=j == 1,
+                    active_a=active_a is not None and p.name == active_a.name,
+                    active_b=active_b is not None and p.name == active_b.name,
+                    in_draft=j == 0 and pos in teampreview_draft,
+                )
+        return buffer
+
+    def discard(self, battle: AbstractBattle):
+        self._buffers.pop((battle.battle_tag, battle.player_role), None)
+        self._stable_keys.pop((battle.battle_tag, battle.player_role), None)
+
+    @staticmethod
+    def to_compact(
+        obs: npt.NDArray[np.float32], dtype: npt.DTypeLike = np.float32
+    ) -> dict[str, npt.NDArray[Any]]:
+        # compact layout: the global vector once, one side vector per team, the (12, 6) vocabulary
+        # ids as int16 and the remaining per-pokemon floats (leading frame dimensions are kept)
+        return {
+            "glob": obs[..., 0, :doubles_side_offset].astype(dtype),
+            "side": obs[..., [0, 6], doubles_side_offset:doubles_pokemon_offset].astype(dtype),
+            "ids": obs[..., doubles_pokemon_offset : doubles_pokemon_offset + 6].astype(np.int16),
+            "pokemon": obs[..., doubles_pokemon_offset + 6 :].astype(dtype),
+        }
+
+    @staticmethod
+    def write_global(
+        out: npt.NDArray[np.float32],
+        battle: DoubleBattle,
+        action_mask: npt.NDArray[np.bool_] | None = None,
+    ):
+        if battle._last_request:
+            legal = Agent.get_action_mask(battle)
+            out[: 2 * doubles_act_len] = ~legal
+            if action_mask is not None:
+                action_mask[:] = legal
+        elif action_mask is not None:
+            action_mask[:] = True
+        weather_encoder.write_values(
+            out[doubles_weather_offset:doubles_field_offset],
+            {w: min(battle.turn - t, 8) / 8 for w, t in battle.weather.items()},
+        )
+        field_encoder.write_values(
+            out[doubles_field_offset:doubles_flag_offset],
+            {f: min(battle.turn - t, 8) / 8 for f, t in battle.fields.items()},
+        )
+        out[doubles_flag_offset] = battle.teampreview
+        out[doubles_flag_offset + 1 : doubles_flag_offset + 3] = battle.force_switch
+
+    @staticmethod
+    def write_side(
+        out: npt.NDArray[np.float32], battle: DoubleBattle, fake_ratings: bool, opp: bool = False
+    ):
+        side_conds = battle.opponent_side_conditions if opp else battle.side_conditions
+        side_condition_encoder.write_values(
+            out[: side_condition_encoder.size],
+            {
+                s: (
+                    1
+                    if s == SideCondition.STEALTH_ROCK
+                    else (
+                        v / 2
+                        if s == SideCondition.TOXIC_SPIKES
+                        else v / 3 if s == SideCondition.SPIKES else min(battle.turn - v, 8) / 8
+                    )
+                )
+                for s, v in side_conds.items()
+            },
+        )
+        if opp:
+            gims = [
+                battle.opponent_can_mega_evolve[0],
+                battle.opponent_can_z_move[0],
+                battle.opponent_can_dynamax[0],
+                battle._opponent_can_terrastallize,
+            ]
+            rat = battle.opponent_rating
+        else:
+            gims = [
+                battle.can_mega_evolve[0],
+                battle.can_z_move[0],
+                battle.can_dynamax[0],
+                battle.can_tera[0] is not False,
+            ]
+            rat = battle.rating
+        out[side_condition_encoder.size : side_condition_encoder.size + 4] = gims
+        out[side_condition_encoder.size + 4] = 1 if fake_ratings else (rat or 0) / 2000
+
+    @staticmethod
+    def get_stable_key(pokemon: Pokemon) -> tuple[Any, ...]:
+        return (
+            pokemon.ability,
+            pokemon.item,
+            tuple(pokemon.moves),
+            pokemon.types,
+            pokemon.tera_type,
+            tuple(pokemon.stats.values()),
+            pokemon.gender,
+            pokemon.weight,
+        )
+
+    @staticmethod
+    def write_stable_pokemon(out: npt.NDArray[np.float32], pokemon: Pokemon):
+        out[0] = get_ability_id(pokemon.ability)
+        out[1] = get_item_id(pokemon.item)
+        for i, move in enumerate(list(pokemon.moves.values())[:4]):
+            out[2 + i] = get_move_id(move.id)
+            start = pokemon_move_offset + i * move_obs_len
+            out[start : start + move_obs_len] = get_static_move(move)
+        pokemon_type_encoder.write(
+            out[pokemon_type_offset : pokemon_type_offset + pokemon_type_encoder.size],
+            pokemon.types,
+        )
+        pokemon_type_encoder.write(
+            out[pokemon_type_offset + pokemon_type_encoder.size : pokemon_stat_offset],
+            [pokemon.tera_type],
+        )
+        out[pokemon_stat_offset:pokemon_gender_offset] = [
+            (s or 0) / 1000 for s in pokemon.stats.values()
+        ]
+        weight_offset = pokemon_volatile_offset - 1
+        gender_encoder.write(out[pokemon_gender_offset:weight_offset], [pokemon.gender])
+        out[weight_offset] = pokemon.weight / 1000
+
+    @staticmethod
+    def write_volatile_pokemon(
+        out: npt.NDArray[np.float32],
+        pokemon: Pokemon,
+        pos: int,
+        from_opponent: bool,
+        active_a: bool,
+        active_b: bool,
+        in_draft: bool = False,
+    ):
+        for i, move in enumerate(list(pokemon.moves.values())[:4]):
+            out[pokemon_move_offset + i * move_obs_len + move_pp_frac_offset] = (
+                move.current_pp / move.max_pp
+            )
+        out[pokemon_volatile_offset] = pokemon.current_hp_fraction
+        out[pokemon_volatile_offset + 1] = pokemon.revealed
+        status_encoder.write(
+            out[pokemon_status_offset : pokemon_boost_offset - 1], [pokemon.status]
+        )
+        out[pokemon_boost_offset - 1] = pokemon.status_counter / 16
+        out[pokemon_boost_offset:pokemon_effect_offset] = [b / 6 for b in pokemon.boosts.values()]
+        effect_encoder.write_values(
+            out[pokemon_effect_offset:pokemon_flag_offset],
+            {e: min(c, 8) / 8 for e, c in pokemon.effects.items()},
+        )
+        out[pokemon_flag_offset : pokemon_flag_offset + 8] = [
+            pokemon.first_turn,
+            pokemon.protect_counter / 5,
+            pokemon.must_recharge,
+            pokemon.preparing,
+            pokemon.is_dynamaxed,
+            pokemon.is_terastallized,
+            active_a,
+            active_b,
+        ]
+        out[pokemon_flag_offset + 8 + pos] = 1
+        out[pokemon_flag_offset + 14] = from_opponent
+        out[pokemon_flag_offset + 15] = in_draft
+
+
+class InferenceServer:
+    max_batch_size: int
+    max_wait: float
+    _pending: dict[
+        ActorCriticPolicy,
+        list[
+            tuple[
+                npt.NDArray[np.float32],
+                npt.NDArray[np.bool_],
+                str | None,
+                asyncio.Future[npt.NDArray[Any]],
+            ]
+        ],
+    ]
+    _flush_handle: asyncio.TimerHandle | None
+
+    # queues decisions from every battle (and every agent sharing the server) on the event loop and
+    # answers them with one forward pass per policy, once max_batch_size requests are waiting or
+    # the oldest one has waited max_wait seconds
+    def __init__(self, max_batch_size: int = 64, max_wait: float = 0.002):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = {}
+        self._flush_handle = None
+
+    async def infer(
+        self,
+        policy: ActorCriticPolicy,
+        obs: npt.NDArray[np.float32],
+        action_mask: npt.NDArray[np.bool_],
+        stream_key: str | None = None,
+    ) -> npt.NDArray[Any]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        requests = self._pending.setdefault(policy, [])
+        requests += [(obs, action_mask, stream_key, future)]
+        if len(requests) >= self.max_batch_size:
+            self._flush_policy(policy)
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self.flush)
+        return await future
+
+    def flush(self):
+        self._flush_handle = None
+        for policy in list(self._pending):
+            self._flush_policy(policy)
+
+    def _flush_policy(self, policy: ActorCriticPolicy):
+        requests = self._pending.pop(policy, [])
+        for i in range(0, len(requests), self.max_batch_size):
+            batch = requests[i : i + self.max_batch_size]
+            try:
+                stream_keys = [k for _, _, k, _ in batch]
+                actions = self.predict(
+                    policy,
+                    np.stack([obs for obs, _, _, _ in batch]),
+                    np.stack([m for _, m, _, _ in batch]),
+                    None if None in stream_keys else stream_keys,  # type: ignore
+                )
+            except Exception as e:
+                for _, _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, _, _, future), action in zip(batch, actions):
+                if not future.done():
+                    future.set_result(action)
+
+    @staticmethod
+    def predict(
+        policy: ActorCriticPolicy,
+        obs: npt.NDArray[np.float32],
+        action_masks: npt.NDArray[np.bool_],
+        stream_keys: list[str] | None = None,
+    ) -> npt.NDArray[Any]:
+        # with stream_keys, frame-stacked policies reuse the encodings of each stream's older frames
+        if (
+            stream_keys is not None
+            and isinstance(policy, MaskedActorCriticPolicy)
+            and policy.num_frames > 1
+        ):
+            context = policy.incremental(stream_keys)
+        else:
+            context = nullcontext()
+        with torch.no_grad(), context:
+            # observations are rounded to the storage dtype the policy was trained on
+            if isinstance(policy.observation_space, Dict):
+                dtype = policy.observation_space["pokemon"].dtype
+                assert dtype is not None
+                compact_obs = ObservationWriter.to_compact(obs, dtype)
+                obs_tensor = {
+                    k: torch.as_tensor(v, device=policy.device) for k, v in compact_obs.items()
+                }
+            else:
+                obs = obs.astype(policy.observation_space.dtype, copy=False)
+                obs_tensor = torch.as_tensor(obs, device=policy.device)
+            mask_tensor = torch.as_tensor(action_masks, device=policy.device)
+            action, _, _ = policy.forward(obs_tensor, action_mask=mask_tensor)  # type: ignore
+        return action.cpu().numpy()
+
 
 class Agent(Player):
     __policy: ActorCriticPolicy | None
-    frames: Deque[npt.NDArray[np.float32]]
+    num_frames: int
+    _frames: dict[str, npt.NDArray[np.float32]]
+    _frame_indices: dict[str, int]
     _teampreview_draft: list[int]
+    _observation_writer: ObservationWriter
+    _action_mask: npt.NDArray[np.bool_]
+    inference_server: InferenceServer | None
 
-    def __init__(self, num_frames: int, device: torch.device, *args: Any, **kwargs: Any):
+    def __init__(
+        self,
+        num_frames: int,
+        device: torch.device,
+        *args: Any,
+        inference_server: InferenceServer | None = None,
+        **kwargs: Any,
+    ):
         super().__init__(*args, **kwargs)
         self.__policy = None
-        self.frames = Deque(maxlen=num_frames)
+        self.inference_server = inference_server
+        self.num_frames = num_frames
+        self._frames = {}
+        self._frame_indices = {}
         self.device = device
         self._teampreview_draft = []
+        self._observation_writer = ObservationWriter()
+        self._action_mask = np.ones(2 * doubles_act_len, dtype=np.bool_)
 
     def set_policy(self, policy: ActorCriticPolicy):
-        self.__policy = policy.to(self.device)
+        # quantized policies always run on the CPU, and are left uncompiled; only the quantized copy
+        # is kept, so the float32 policy is freed once the caller drops it
+        if quantize_inference and isinstance(policy, MaskedActorCriticPolicy):
+            self.__policy = policy.quantize_inference()
+        else:
+            self.__policy = policy.to(self.device)
+            if compile_inference and isinstance(policy, MaskedActorCriticPolicy):
+                policy.compile_inference()
+        if isinstance(self.__policy, MaskedActorCriticPolicy):
+            self.__policy.clear_streams()
+
+    @property
+    def has_policy(self) -> bool:
+        return self.__policy is not None
 
-    def choose_move(self, battle: AbstractBattle) -> BattleOrder:
+    def set_policy_state_dict(self, state_dict: dict[str, torch.Tensor]):
+        # swaps in new weights for the policy given to set_policy, so callers in other processes
+        # only have to send tensors; a quantized policy is requantized from the float32 weights
+        assert self.__policy is not None
+        if quantize_inference and isinstance(self.__policy, MaskedActorCriticPolicy):
+            self.__policy = self.__policy.quantize_inference(state_dict)
+        else:
+            self.__policy.load_state_dict(state_dict)
+        if isinstance(self.__policy, MaskedActorCriticPolicy):
+            self.__policy.clear_streams()
+
+    def choose_move(self, battle: AbstractBattle) -> BattleOrder | Awaitable[BattleOrder]:
         assert isinstance(battle, DoubleBattle)
         assert self.__policy is not None
-        assert self.frames.maxlen is not None
         if battle.teampreview and len(self._teampreview_draft) == 4:
             self._teampreview_draft = []
-        obs = self.embed_battle(battle, self._teampreview_draft, fake_ratings=True)
+        obs = self._observation_writer.write(
+            battle, self._teampreview_draft, fake_ratings=True, action_mask=self._action_mask
+        )
         if battle.turn == 0 and not (
             battle.teampreview and len([p for p in battle.team.values() if p.active]) > 0
         ):
-            for _ in range(self.frames.maxlen):
-                self.frames.append(np.zeros([12, doubles_chunk_obs_len], dtype=np.float32))
-        if self.frames.maxlen > 1:
-            self.frames.append(obs)
-            obs = np.stack(self.frames)
-        with torch.no_grad():
-            obs_tensor = torch.as_tensor(obs, device=self.__policy.device).unsqueeze(0)
-            action, _, _ = self.__policy.forward(obs_tensor)
-        action = action.cpu().numpy()[0]
+            self._frames.pop(battle.battle_tag, None)
+            self.evict_stream(battle)
+        if self.num_frames > 1:
+            obs = self.push_frame(battle.battle_tag, obs)
+        if self.inference_server is not None:
+            return self._choose_move_batched(battle, obs, self._action_mask.copy())
+        action = InferenceServer.predict(
+            self.__policy, obs[None], self._action_mask[None], [self.get_stream_key(battle)]
+        )[0]
+        return self._action_to_order(action, battle)
+
+    def push_frame(self, battle_tag: str, obs: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+        # every frame is written twice into a zero-initialized ring of 2 * num_frames slots, so the
+        # last num_frames frames are always a contiguous view in chronological order
+        frames = self._frames.get(battle_tag)
+        if frames is None:
+            frames = np.zeros((2 * self.num_frames, *obs.shape), dtype=np.float32)
+            self._frames[battle_tag] = frames
+            self._frame_indices[battle_tag] = 0
+        i = self._frame_indices[battle_tag]
+        frames[i] = obs
+        frames[i + self.num_frames] = obs
+        self._frame_indices[battle_tag] = (i + 1) % self.num_frames
+        return frames[i + 1 : i + 1 + self.num_frames]
+
+    def _battle_finished_callback(self, battle: AbstractBattle):
+        super()._battle_finished_callback(battle)
+        self._frames.pop(battle.battle_tag, None)
+        self._frame_indices.pop(battle.battle_tag, None)
+        self._observation_writer.discard(battle)
+        self.evict_stream(battle)
+
+    @staticmethod
+    def get_stream_key(battle: AbstractBattle) -> str:
+        # both players of a battle may share a policy, so streams are per battle and side
+        return f"{battle.battle_tag}-{battle.player_role}"
+
+    def evict_stream(self, battle: AbstractBattle):
+        if isinstance(self.__policy, MaskedActorCriticPolicy):
+            self.__policy.evict_stream(self.get_stream_key(battle))
+
+    async def _choose_move_batched(
+        self, battle: DoubleBattle, obs: npt.NDArray[np.float32], action_mask: npt.NDArray[np.bool_]
+    ) -> BattleOrder:
+        assert self.inference_server is not None
+        assert self.__policy is not None
+        action = await self.inference_server.infer(
+            self.__policy, obs, action_mask, self.get_stream_key(battle)
+        )
+        return self._action_to_order(action, battle)
+
+    def _action_to_order(self, action: npt.NDArray[np.int64], battle: DoubleBattle) -> BattleOrder:
+        assert self.__policy is not None
         if battle.teampreview:
             if not self.__policy.chooses_on_teampreview:
                 available_actions = [i for i in range(1, 7) if i - 1 not in self._teampreview_draft]
@@ -80,20 +567,39 @@ class Agent(Player):
         if isinstance(battle, Battle):
             return self.random_teampreview(battle)
         elif isinstance(battle, DoubleBattle):
+            if self.inference_server is not None:
+                return self._teampreview_batched(battle)  # type: ignore
             order1 = self.choose_move(battle)
+            assert isinstance(order1, BattleOrder)
             upd_battle = _EnvPlayer._simulate_teampreview_switchin(order1, battle)
             order2 = self.choose_move(upd_battle)
-            action1 = DoublesEnv.order_to_action(order1, battle)
-            action2 = DoublesEnv.order_to_action(order2, upd_battle)
-            if self.__policy.chooses_on_teampreview:  # type: ignore
-                return f"/team {action1[0]}{action1[1]}{action2[0]}{action2[1]}"
-            else:
-                message = self.random_teampreview(battle)
-                self._teampreview_draft = [int(i) - 1 for i in message[6:-2]]
-                return message
+            assert isinstance(order2, BattleOrder)
+            return self._teampreview_message(battle, upd_battle, order1, order2)
         else:
             raise TypeError()
 
+    async def _teampreview_batched(self, battle: DoubleBattle) -> str:
+        order1 = await self.choose_move(battle)  # type: ignore
+        upd_battle = _EnvPlayer._simulate_teampreview_switchin(order1, battle)
+        order2 = await self.choose_move(upd_battle)  # type: ignore
+        return self._teampreview_message(battle, upd_battle, order1, order2)
+
+    def _teampreview_message(
+        self,
+        battle: DoubleBattle,
+        upd_battle: DoubleBattle,
+        order1: BattleOrder,
+        order2: BattleOrder,
+    ) -> str:
+        action1 = DoublesEnv.order_to_action(order1, battle)
+        action2 = DoublesEnv.order_to_action(order2, upd_battle)
+        if self.__policy.chooses_on_teampreview:  # type: ignore
+            return f"/team {action1[0]}{action1[1]}{action2[0]}{action2[1]}"
+        else:
+            message = self.random_teampreview(battle)
+            self._teampreview_draft = [int(i) - 1 for i in message[6:-2]]
+            return message
+
     @staticmethod
     def embed_battle(
         battle: AbstractBattle, teampreview_draft: list[int], fake_ratings: bool = False
@@ -153,23 +659,20 @@ class Agent(Player):
             if not battle._last_request:
                 mask = np.zeros(2 * doubles_act_len, dtype=np.float32)
             else:
-                action_space1 = Agent.get_action_space(battle, 0)
-                mask1 = [float(i not in action_space1) for i in range(doubles_act_len)]
-                action_space2 = Agent.get_action_space(battle, 1)
-                mask2 = [float(i not in action_space2) for i in range(doubles_act_len)]
-                mask = mask1 + mask2
+                mask = ~Agent.get_action_mask(battle)
             force_switch = [float(f) for f in battle.force_switch]
         else:
             raise TypeError()
-        weather = [
-            (min(battle.turn - battle.weather[w], 8) / 8 if w in battle.weather else 0)
-            for w in Weather
-        ]
-        fields = [
-            min(battle.turn - battle.fields[f], 8) / 8 if f in battle.fields else 0 for f in Field
-        ]
+        weather = weather_encoder.encode_values(
+            {w: min(battle.turn - t, 8) / 8 for w, t in battle.weather.items()}
+        )
+        fields = field_encoder.encode_values(
+            {f: min(battle.turn - t, 8) / 8 for f, t in battle.fields.items()}
+        )
         teampreview = float(battle.teampreview)
-        return np.array([*mask, *weather, *fields, teampreview, *force_switch], dtype=np.float32)
+        return np.concatenate(
+            [mask, weather, fields, [teampreview, *force_switch]], dtype=np.float32
+        )
 
     @staticmethod
     def embed_side(
@@ -204,31 +707,25 @@ class Agent(Player):
         else:
             raise TypeError()
         side_conds = battle.opponent_side_conditions if opp else battle.side_conditions
-        side_conditions = [
-            (
-                0
-                if s not in side_conds
-                else (
+        side_conditions = side_condition_encoder.encode_values(
+            {
+                s: (
                     1
                     if s == SideCondition.STEALTH_ROCK
                     else (
-                        side_conds[s] / 2
+                        v / 2
                         if s == SideCondition.TOXIC_SPIKES
-                        else (
-                            side_conds[s] / 3
-                            if s == SideCondition.SPIKES
-                            else min(battle.turn - side_conds[s], 8) / 8
-                        )
+                        else v / 3 if s == SideCondition.SPIKES else min(battle.turn - v, 8) / 8
                     )
                 )
-            )
-            for s in SideCondition
-        ]
+                for s, v in side_conds.items()
+            }
+        )
         gims = opp_gims if opp else gims
         gimmicks = [float(g) for g in gims]
         rat = battle.opponent_rating if opp else battle.rating
         rating = 1 if fake_ratings else (rat or 0) / 2000
-        return np.array([*side_conditions, *gimmicks, rating], dtype=np.float32)
+        return np.concatenate([side_conditions, [*gimmicks, rating]], dtype=np.float32)
 
     @staticmethod
     def embed_pokemon(
@@ -240,99 +737,66 @@ class Agent(Player):
         in_draft: bool = False,
     ) -> npt.NDArray[np.float32]:
         # (mostly) stable fields
-        ability_id = abilities.index("null" if pokemon.ability is None else pokemon.ability)
-        item_id = items.index("null" if pokemon.item is None else pokemon.item)
-        move_ids = [
-            moves.index("hiddenpower" if move.id.startswith("hiddenpower") else move.id)
-            for move in pokemon.moves.values()
-        ]
+        ability_id = get_ability_id(pokemon.ability)
+        item_id = get_item_id(pokemon.item)
+        move_ids = [get_move_id(move.id) for move in pokemon.moves.values()]
         move_ids += [0] * (4 - len(move_ids))
         move_embeds = [Agent.embed_move(move) for move in pokemon.moves.values()]
         move_embeds += [np.zeros(move_obs_len, dtype=np.float32)] * (4 - len(move_embeds))
         move_embeds = np.concatenate(move_embeds)
-        types = [float(t in pokemon.types) for t in PokemonType]
-        tera_type = [float(t == pokemon.tera_type) for t in PokemonType]
+        types = pokemon_type_encoder.encode(pokemon.types)
+        tera_type = pokemon_type_encoder.encode([pokemon.tera_type])
         stats = [(s or 0) / 1000 for s in pokemon.stats.values()]
-        gender = [float(g == pokemon.gender) for g in PokemonGender]
+        gender = gender_encoder.encode([pokemon.gender])
         weight = pokemon.weight / 1000
         # volatile fields
         hp_frac = pokemon.current_hp_fraction
         revealed = float(pokemon.revealed)
-        status = [float(s == pokemon.status) for s in Status]
+        status = status_encoder.encode([pokemon.status])
         status_counter = pokemon.status_counter / 16
         boosts = [b / 6 for b in pokemon.boosts.values()]
-        effects = [(min(pokemon.effects[e], 8) / 8 if e in pokemon.effects else 0) for e in Effect]
+        effects = effect_encoder.encode_values(
+            {e: min(c, 8) / 8 for e, c in pokemon.effects.items()}
+        )
         first_turn = float(pokemon.first_turn)
         protect_counter = pokemon.protect_counter / 5
         must_recharge = float(pokemon.must_recharge)
         preparing = float(pokemon.preparing)
         gimmicks = [float(s) for s in [pokemon.is_dynamaxed, pokemon.is_terastallized]]
         pos_onehot = [float(pos == i) for i in range(6)]
-        return np.array(
+        return np.concatenate(
             [
-                ability_id,
-                item_id,
-                *move_ids,
-                *move_embeds,
-                *types,
-                *tera_type,
-                *stats,
-                *gender,
-                weight,
-                hp_frac,
-                revealed,
-                *status,
-                status_counter,
-                *boosts,
-                *effects,
-                first_turn,
-                protect_counter,
-                must_recharge,
-                preparing,
-                *gimmicks,
-                float(active_a),
-                float(active_b),
-                *pos_onehot,
-                float(from_opponent),
-                float(in_draft),
+                [ability_id, item_id, *move_ids],
+                move_embeds,
+                types,
+                tera_type,
+                stats,
+                gender,
+                [weight, hp_frac, revealed],
+                status,
+                [status_counter, *boosts],
+                effects,
+                [
+                    first_turn,
+                    protect_counter,
+                    must_recharge,
+                    preparing,
+                    *gimmicks,
+                    float(active_a),
+                    float(active_b),
+                    *pos_onehot,
+                    float(from_opponent),
+                    float(in_draft),
+                ],
             ],
             dtype=np.float32,
         )
 
     @staticmethod
     def embed_move(move: Move) -> npt.NDArray[np.float32]:
-        power = move.base_power / 250
-        acc = move.accuracy / 100
-        category = [float(c == move.category) for c in MoveCategory]
-        target = [float(t == move.target) for t in Target]
-        priority = (move.priority + 7) / 12
-        crit_ratio = move.crit_ratio
-        drain = move.drain
-        force_switch = float(move.force_switch)
-        recoil = move.recoil
-        self_destruct = float(move.self_destruct is not None)
-        self_switch = float(move.self_switch is not False)
-        pp = move.max_pp / 64
-        pp_frac = move.current_pp / move.max_pp
-        move_type = [float(t == move.type) for t in PokemonType]
-        return np.array(
-            [
-                power,
-                acc,
-                *category,
-                *target,
-                priority,
-                crit_ratio,
-                drain,
-                force_switch,
-                recoil,
-                self_destruct,
-                self_switch,
-                pp,
-                pp_frac,
-                *move_type,
-            ]
-        )
+        embedding = get_static_move(move).copy()
+        embedding[move_pp_frac_offset] = move.current_pp / move.max_pp
+        return embedding
 
     @staticmethod
     def get_action_space(battle: AbstractBattle, pos: int | None = None) -> npt.NDArray[np.int64]:
@@ -410,3 +874,55 @@ class Agent(Player):
                 return np.array((switch_space + move_space + tera_space) or [0])
         else:
             raise TypeError()
+
+    @staticmethod
+    def get_action_mask(battle: DoubleBattle) -> npt.NDArray[np.bool_]:
+        # same legal actions as get_action_space(battle, 0) and get_action_space(battle, 1), but
+        # with the membership sets built once and the result written straight into a mask
+        mask = np.zeros((2, doubles_act_len), dtype=np.bool_)
+        team = list(battle.team.values())
+        for pos in range(2):
+            legal = mask[pos]
+            can_switch = (
+                battle.force_switch != [[False, True], [True, False]][pos]
+                and not battle.trapped[pos]
+                and not (
+                    len(battle.available_switches[0]) == 1
+                    and battle.force_switch == [True, True]
+                    and pos == 1
+                )
+            )
+            switch_species = {p.species for p in battle.available_switches[pos]}
+            switch_space = [
+                i + 1
+                for i, pokemon in enumerate(team)
+                if can_switch and not pokemon.active and pokemon.species in switch_species
+            ]
+            active_mon = battle.active_pokemon[pos]
+            if battle.teampreview:
+                legal[switch_space] = True
+            elif battle.finished or battle._wait:
+                legal[0] = True
+            elif active_mon is None:
+                legal[switch_space or [0]] = True
+            else:
+                available_moves = {m.id for m in battle.available_moves[pos]}
+                move_space = [
+                    7 + 5 * i + j + 2
+                    for i, move in enumerate(active_mon.moves.values())
+                    if move.id in available_moves
+                    for j in battle.get_possible_showdown_targets(move, active_mon)
+                ]
+                legal[switch_space] = True
+                legal[move_space] = True
+                if battle.can_tera[pos]:
+                    legal[[i + 80 for i in move_space]] = True
+                if (
+                    not move_space
+                    and len(battle.available_moves[pos]) == 1
+                    and battle.available_moves[pos][0].id in ["struggle", "recharge"]
+                ):
+                    legal[9] = True
+                if not legal.any():
+                    legal[0] = True
+        return mask.reshape(-1)
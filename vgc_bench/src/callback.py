@@ -10,11 +10,19 @@ import torch
 from nashpy import Game
 from poke_env.player import MaxBasePowerPlayer, Player
 from poke_env.ps_client import AccountConfiguration, ServerConfiguration
-from src.agent import Agent
+from src.agent import Agent, InferenceServer
+from src.checkpoints import CheckpointRegistry, CheckpointWriter, PolicyCache, SharedWeights
 from src.policy import MaskedActorCriticPolicy
 from src.teams import RandomTeamBuilder, TeamToggle
-from src.utils import LearningStyle, allow_mirror_match, battle_format, steps
-from stable_baselines3 import PPO
+from src.utils import (
+    LearningStyle,
+    allow_mirror_match,
+    battle_format,
+    chooses_on_teampreview,
+    policy_cache_mb,
+    quantize_inference,
+    steps,
+)
 from stable_baselines3.common.callbacks import BaseCallback
 
 warnings.filterwarnings("ignore", category=UserWarning)
@@ -44,13 +52,15 @@ class Callback(BaseCallback):
         )[1:]
         if not os.path.exists(f"results/logs-{self.run_ident}"):
             os.mkdir(f"results/logs-{self.run_ident}")
+        self.registry = CheckpointRegistry(
+            f"results/saves-{self.run_ident}/{','.join([str(t) for t in self.teams])}-teams"
+        )
+        # the whole pool is sampled from, so no checkpoints are pruned
+        self.checkpoint_writer = CheckpointWriter(self.registry)
         self.payoff_matrix: npt.NDArray[np.float32]
         self.prob_dist: list[float] | None = None
         if self.learning_style == LearningStyle.LAST_SELF:
-            policy_files = os.listdir(
-                f"results/saves-{self.run_ident}/{','.join([str(t) for t in self.teams])}-teams"
-            )
-            self.prob_dist = [0.0] * len(policy_files)
+            self.prob_dist = [0.0] * len(self.registry)
             self.prob_dist[-1] = 1
         elif self.learning_style == LearningStyle.DOUBLE_ORACLE:
             if os.path.exists(
@@ -64,7 +74,13 @@ class Callback(BaseCallback):
                 self.payoff_matrix = np.array([[0]])
             g = Game(self.payoff_matrix)
             self.prob_dist = g.linear_program()[0].tolist()  # type: ignore
+        self.policy_cache = PolicyCache(policy_cache_mb * 2**20)
+        self.weights_header = {
+            "num_frames": num_frames,
+            "chooses_on_teampreview": chooses_on_teampreview,
+        }
         toggle = None if allow_mirror_match else TeamToggle(len(teams))
+        inference_server = InferenceServer()
         self.eval_agent = Agent(
             num_frames,
             torch.device(device),
@@ -81,6 +97,7 @@ class Callback(BaseCallback):
             team=RandomTeamBuilder(
                 [0] if learning_style == LearningStyle.EXPLOITER else teams, battle_format, toggle
             ),
+            inference_server=inference_server,
         )
         self.eval_agent2 = Agent(
             num_frames,
@@ -98,6 +115,7 @@ class Callback(BaseCallback):
             team=RandomTeamBuilder(
                 [0] if learning_style == LearningStyle.EXPLOITER else teams, battle_format, toggle
             ),
+            inference_server=inference_server,
         )
         self.eval_opponent = MaxBasePowerPlayer(
             account_configuration=AccountConfiguration.randgen(10),
@@ -123,28 +141,13 @@ class Callback(BaseCallback):
         if self.model.num_timesteps < steps:
             self.evaluate()
         if not self.behavior_clone:
-            self.model.save(
-                f"results/saves-{self.run_ident}/{','.join([str(t) for t in self.teams])}-teams/{self.model.num_timesteps}"
-            )
-        else:
-            try:
-                saves = [
-                    int(file[:-4])
-                    for file in os.listdir(
-                        f"results/saves-{self.run_ident}/{','.join([str(t) for t in self.teams])}-teams"
-                    )
-                    if int(file[:-4]) >= 0
-                ]
-            except FileNotFoundError:
-                raise FileNotFoundError("behavior_clone on, but no model initialization found")
-            assert len(saves) > 0
+            self.save()
+        elif self.registry.latest() is None:
+            raise FileNotFoundError("behavior_clone on, but no model initialization found")
         if self.learning_style == LearningStyle.EXPLOITER:
-            policy = PPO.load(
-                f"results/saves-{self.run_ident}/{','.join([str(t) for t in self.teams])}-teams/-1",
-                device=self.model.device,
-            ).policy
-            for i in range(self.model.env.num_envs):
-                self.model.env.env_method("set_opp_policy", policy, indices=i)
+            state_dict = self.policy_cache.load(self.registry.path("-1.zip"))
+            with SharedWeights.publish(state_dict, self.weights_header) as weights:
+                self.model.env.env_method("set_opp_weights", weights)
 
     def _on_rollout_start(self):
         assert self.model.env is not None
@@ -156,28 +159,33 @@ class Callback(BaseCallback):
             LearningStyle.FICTITIOUS_PLAY,
             LearningStyle.DOUBLE_ORACLE,
         ]:
-            policy_files = os.listdir(
-                f"results/saves-{self.run_ident}/{','.join([str(t) for t in self.teams])}-teams"
-            )
+            # the pool includes the checkpoint saved at training start, which may still be in flight
+            self.checkpoint_writer.flush()
+            policy_files = self.registry.files()
             policies = random.choices(
                 policy_files, weights=self.prob_dist, k=self.model.env.num_envs
             )
-            for i in range(self.model.env.num_envs):
-                self.model.env.env_method("cleanup", indices=i)
-                policy = PPO.load(
-                    f"results/saves-{self.run_ident}/{','.join([str(t) for t in self.teams])}-teams/{policies[i]}",
-                    device=self.model.device,
-                ).policy
-                self.model.env.env_method("set_opp_policy", policy, indices=i)
+            self.model.env.env_method("cleanup")
+            # each sampled checkpoint is read through the policy cache and published to shared
+            # memory once, and all envs that sampled it are sent its handle in one call so their
+            # workers load it concurrently; the block is unlinked once they have copied it
+            for policy_file in dict.fromkeys(policies):
+                state_dict = self.policy_cache.load(self.registry.path(policy_file))
+                indices = [i for i, p in enumerate(policies) if p == policy_file]
+                with SharedWeights.publish(state_dict, self.weights_header) as weights:
+                    self.model.env.env_method("set_opp_weights", weights, indices=indices)
 
     def _on_training_end(self):
         self.evaluate()
         self.model.logger.dump(self.model.num_timesteps)
+        payoff = None
         if self.learning_style == LearningStyle.DOUBLE_ORACLE:
-            self.update_payoff_matrix()
-        self.model.save(
-            f"results/saves-{self.run_ident}/{','.join([str(t) for t in self.teams])}-teams/{self.model.num_timesteps}"
-        )
+            payoff = self.update_payoff_matrix()
+        self.save(payoff)
+        self.checkpoint_writer.close()
+
+    def save(self, payoff: list[float] | None = None):
+        self.checkpoint_writer.save(self.model, self.model.num_timesteps, payoff)
 
     def evaluate(self):
         policy = MaskedActorCriticPolicy.clone(self.model)
@@ -185,18 +193,12 @@ class Callback(BaseCallback):
         win_rate = self.compare(self.eval_agent, self.eval_opponent, 100)
         self.model.logger.record("train/eval", win_rate)
 
-    def update_payoff_matrix(self):
+    def update_payoff_matrix(self) -> list[float]:
         policy = MaskedActorCriticPolicy.clone(self.model)
         self.eval_agent.set_policy(policy)
-        policy_files = os.listdir(
-            f"results/saves-{self.run_ident}/{','.join([str(t) for t in self.teams])}-teams"
-        )
         win_rates = np.array([])
-        for p in policy_files:
-            policy2 = PPO.load(
-                f"results/saves-{self.run_ident}/{','.join([str(t) for t in self.teams])}-teams/{p}",
-                device=self.model.device,
-            ).policy
+        for p in self.registry.files():
+            policy2 = self.load_policy(self.registry.path(p))
             self.eval_agent2.set_policy(policy2)
             win_rate = self.compare(self.eval_agent, self.eval_agent2, 100)
             win_rates = np.append(win_rates, round(2 * win_rate - 1, ndigits=2))
@@ -208,6 +210,14 @@ class Callback(BaseCallback):
             "w",
         ) as f:
             json.dump((self.payoff_matrix.tolist()), f)
+        return win_rates.tolist()
+
+    def load_policy(self, path: str) -> MaskedActorCriticPolicy:
+        # builds the policy from the training model's architecture and the cached checkpoint
+        # weights, instead of deserializing the whole saved model
+        policy = MaskedActorCriticPolicy.clone(self.model)
+        policy.load_state_dict(self.policy_cache.load(path))
+        return policy.to("cpu" if quantize_inference else self.model.device)
 
     @staticmethod
     def compare(player1: Player, player2: Player, n_battles: int) -> float:
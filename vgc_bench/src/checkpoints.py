@@ -0,0 +1,395 @@
+import fcntl
+import hashlib
+import io
+import json
+import math
+import os
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from multiprocessing.shared_memory import SharedMemory
+from operator import attrgetter
+from typing import Any, Iterator
+
+import torch
+from gymnasium import Space
+from gymnasium.vector.utils import batch_space
+from src.policy import MaskedActorCriticPolicy
+from stable_baselines3.common.base_class import BaseAlgorithm
+from stable_baselines3.common.save_util import data_to_json, save_to_zip_file
+
+
+def weights_path(path: str) -> str:
+    # the weights-only sidecar of <steps>.zip is <steps>.pt in the same directory
+    return f"{path.removesuffix('.zip')}.pt"
+
+
+def load_policy_weights(path: str) -> tuple[dict[str, Any], dict[str, torch.Tensor]]:
+    checkpoint = torch.load(path, map_location="cpu", weights_only=True)
+    state_dict = checkpoint.pop("state_dict")
+    return checkpoint, state_dict
+
+
+def build_policy(
+    header: dict[str, Any],
+    state_dict: dict[str, torch.Tensor],
+    observation_space: Space[Any],
+    action_space: Space[Any],
+) -> MaskedActorCriticPolicy:
+    # observation_space is a single frame, stacked here the way FrameStackObservation stacks it
+    num_frames = header["num_frames"]
+    policy = MaskedActorCriticPolicy(
+        observation_space if num_frames == 1 else batch_space(observation_space, num_frames),
+        action_space,
+        lambda _: 0,
+        num_frames=num_frames,
+        chooses_on_teampreview=header["chooses_on_teampreview"],
+    )
+    policy.load_state_dict(state_dict)
+    return policy
+
+
+def load_policy_state_dict(path: str) -> dict[str, torch.Tensor]:
+    if os.path.exists(weights_path(path)):
+        return load_policy_weights(weights_path(path))[1]
+    # older checkpoints have no sidecar, so only policy.pth is read out of the saved PPO zip,
+    # skipping the optimizer state and pickled data
+    with zipfile.ZipFile(path) as archive:
+        policy_bytes = archive.read("policy.pth")
+    return torch.load(io.BytesIO(policy_bytes), map_location="cpu", weights_only=True)
+
+
+class PolicyCache:
+    max_bytes: int
+    num_bytes: int
+    _entries: OrderedDict[tuple[str, float], dict[str, torch.Tensor]]
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self._entries = OrderedDict()
+
+    def load(self, path: str) -> dict[str, torch.Tensor]:
+        # keyed by the file that is actually read (the sidecar if there is one) and its mtime, so a
+        # checkpoint that is overwritten in place is read again
+        source = weights_path(path) if os.path.exists(weights_path(path)) else path
+        key = (source, os.path.getmtime(source))
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        state_dict = load_policy_state_dict(path)
+        size = self.size_of(state_dict)
+        # least recently used entries are evicted until the new one fits; a state_dict larger than
+        # the whole budget is returned without being cached
+        while self._entries and self.num_bytes + size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.num_bytes -= self.size_of(evicted)
+        if size <= self.max_bytes:
+            self._entries[key] = state_dict
+            self.num_bytes += size
+        return state_dict
+
+    @staticmethod
+    def size_of(state_dict: dict[str, torch.Tensor]) -> int:
+        return sum(t.numel() * t.element_size() for t in state_dict.values())
+
+
+class SharedWeights:
+    # picklable handle to a state_dict published into a named shared memory block, so only the
+    # block name and tensor layout go through a SubprocVecEnv pipe
+    name: str
+    header: dict[str, Any]
+    layout: list[tuple[str, torch.dtype, torch.Size, int]]
+
+    def __init__(
+        self,
+        name: str,
+        header: dict[str, Any],
+        layout: list[tuple[str, torch.dtype, torch.Size, int]],
+    ):
+        self.name = name
+        self.header = header
+        self.layout = layout
+
+    @classmethod
+    @contextmanager
+    def publish(
+        cls, state_dict: dict[str, torch.Tensor], header: dict[str, Any]
+    ) -> Iterator["SharedWeights"]:
+        # the block only lives for the context, so the trainer publishes a checkpoint around the
+        # env_method call that hands it out and /dev/shm never holds more than one checkpoint
+        layout = []
+        size = 0
+        for k, v in state_dict.items():
+            layout += [(k, v.dtype, v.shape, size)]
+            # tensors start on 64-byte boundaries
+            size += -(-v.numel() * v.element_size() // 64) * 64
+        block = SharedMemory(create=True, size=max(size, 1))
+        try:
+            weights = cls(block.name, header, layout)
+            with weights.attach() as shared_state_dict:
+                for k, v in state_dict.items():
+                    shared_state_dict[k].copy_(v)
+            yield weights
+        finally:
+            block.close()
+            block.unlink()
+
+    @contextmanager
+    def attach(self) -> Iterator[dict[str, torch.Tensor]]:
+        # yields zero-copy views of the block, which must not outlive the context; workers share
+        # the trainer's resource tracker, so closing the block here leaves it alive for the others
+        block = SharedMemory(self.name)
+        # torch.frombuffer rejects a count of 0, and empty tensors have nothing to share anyway
+        state_dict = {
+            key: (
+                torch.frombuffer(
+                    block.buf, dtype=dtype, count=math.prod(shape), offset=offset
+                ).view(shape)
+                if math.prod(shape) > 0
+                else torch.empty(shape, dtype=dtype)
+            )
+            for key, dtype, shape, offset in self.layout
+        }
+        try:
+            yield state_dict
+        finally:
+            state_dict.clear()
+            block.close()
+
+
+class CheckpointRegistry:
+    # JSON index of the checkpoints saved in one directory, in save order; each entry holds the
+    # zip's file name, step count, save timestamp, sha256 and (for double oracle) payoff row
+    directory: str
+    index_path: str
+    _entries: list[dict[str, Any]]
+    _index_mtime: int | None
+    _latest: dict[str, Any] | None
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+        self._entries = []
+        self._index_mtime = None
+        self._latest = None
+        if os.path.isdir(directory):
+            with self._lock():
+                self._refresh()
+                # zips that are missing from the index (saved before it existed, or copied in by
+                # hand) are registered in step order
+                known = {e["file"] for e in self._entries}
+                untracked = sorted(
+                    (f for f in os.listdir(directory) if f.endswith(".zip") and f not in known),
+                    key=lambda f: int(f[:-4]),
+                )
+                if untracked:
+                    for file in untracked:
+                        path = os.path.join(directory, file)
+                        self._entries += [self._entry(path, int(file[:-4]), os.path.getmtime(path))]
+                    self._write()
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._entries)
+
+    def files(self) -> list[str]:
+        self._refresh()
+        return [e["file"] for e in self._entries]
+
+    def path(self, file: str) -> str:
+        return os.path.join(self.directory, file)
+
+    def latest(self) -> dict[str, Any] | None:
+        # the entry with the most steps, ignoring pretrained initializations saved at negative steps
+        self._refresh()
+        return self._latest
+
+    def prune(self, keep_last: int, keep_every: int | None = None):
+        # removes all but the last keep_last checkpoints, except pretrained initializations and,
+        # if given, those whose step count is a multiple of keep_every
+        with self._lock():
+            self._refresh()
+            recent = {e["file"] for e in (self._entries[-keep_last:] if keep_last > 0 else [])}
+            removed = [
+                e
+                for e in self._entries
+                if e["file"] not in recent
+                and e["steps"] >= 0
+                and not (keep_every and e["steps"] % keep_every == 0)
+            ]
+            if not removed:
+                return
+            self._entries = [e for e in self._entries if e not in removed]
+            self._write()
+        for e in removed:
+            for file in [self.path(e["file"]), weights_path(self.path(e["file"]))]:
+                if os.path.exists(file):
+                    os.remove(file)
+
+    def add(self, path: str, steps: int, payoff: list[float] | None = None):
+        os.makedirs(self.directory, exist_ok=True)
+        entry = self._entry(path, steps, time.time(), payoff)
+        with self._lock():
+            self._refresh()
+            self._entries = [e for e in self._entries if e["file"] != entry["file"]] + [entry]
+            self._write()
+
+    @staticmethod
+    def _entry(
+        path: str, steps: int, timestamp: float, payoff: list[float] | None = None
+    ) -> dict[str, Any]:
+        path = path if path.endswith(".zip") else f"{path}.zip"
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(2**20), b""):
+                sha256.update(chunk)
+        return {
+            "file": os.path.basename(path),
+            "steps": steps,
+            "timestamp": timestamp,
+            "sha256": sha256.hexdigest(),
+            "payoff": payoff,
+        }
+
+    @contextmanager
+    def _lock(self) -> Iterator[None]:
+        # serializes read-modify-write cycles of runs sharing the directory
+        with open(os.path.join(self.directory, "index.lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        # rereads the index only when another process has replaced it since it was last read
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._index_mtime:
+            with open(self.index_path) as f:
+                self._entries = json.load(f)
+            self._index_mtime = mtime
+            self._update_latest()
+
+    def _write(self):
+        with open(f"{self.index_path}.tmp", "w") as f:
+            json.dump(self._entries, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{self.index_path}.tmp", self.index_path)
+        self._index_mtime = os.stat(self.index_path).st_mtime_ns
+        self._update_latest()
+
+    def _update_latest(self):
+        saves = [e for e in self._entries if e["steps"] >= 0]
+        self._latest = max(saves, key=lambda e: e["steps"]) if saves else None
+
+
+class CheckpointWriter:
+    # saves checkpoints off the training thread: save() snapshots the model to CPU and returns, and
+    # a single worker thread serializes, fsyncs and renames the files into place, then registers
+    # them and applies the retention policy
+    registry: CheckpointRegistry
+    keep_last: int | None
+    keep_every: int | None
+    _executor: ThreadPoolExecutor
+    _pending: list[Future[None]]
+
+    def __init__(
+        self,
+        registry: CheckpointRegistry,
+        keep_last: int | None = None,
+        keep_every: int | None = None,
+    ):
+        self.registry = registry
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = []
+
+    def save(self, model: BaseAlgorithm, steps: int, payoff: list[float] | None = None):
+        self._check_pending()
+        assert isinstance(model.policy, MaskedActorCriticPolicy)
+        # the same pieces BaseAlgorithm.save writes, with the non-torch data serialized now so later
+        # changes to the model can't leak into the checkpoint
+        data = model.__dict__.copy()
+        exclude = set(model._excluded_save_params())
+        state_dict_names, torch_variable_names = model._get_torch_save_params()
+        for name in state_dict_names + torch_variable_names:
+            exclude.add(name.split(".")[0])
+        for name in exclude:
+            data.pop(name, None)
+        pytorch_variables = {
+            name: self.to_cpu(attrgetter(name)(model)) for name in torch_variable_names
+        }
+        params = self.to_cpu(model.get_parameters())
+        header = {
+            "num_frames": model.policy.num_frames,
+            "chooses_on_teampreview": model.policy.chooses_on_teampreview,
+        }
+        self._pending += [
+            self._executor.submit(
+                self._write, steps, data_to_json(data), params, pytorch_variables, header, payoff
+            )
+        ]
+
+    def flush(self):
+        for future in self._pending:
+            future.result()
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        self._executor.shutdown()
+
+    def _check_pending(self):
+        # surfaces a failed write on the training thread instead of losing it
+        done = [f for f in self._pending if f.done()]
+        self._pending = [f for f in self._pending if not f.done()]
+        for future in done:
+            future.result()
+
+    def _write(
+        self,
+        steps: int,
+        serialized_data: str,
+        params: dict[str, Any],
+        pytorch_variables: dict[str, Any],
+        header: dict[str, Any],
+        payoff: list[float] | None,
+    ):
+        os.makedirs(self.registry.directory, exist_ok=True)
+        path = self.registry.path(f"{steps}.zip")
+        with open(f"{path}.tmp", "w+b") as f:
+            save_to_zip_file(f, params=params, pytorch_variables=pytorch_variables)
+            with zipfile.ZipFile(f, mode="a") as archive:
+                archive.writestr("data", serialized_data)
+            f.flush()
+            os.fsync(f.fileno())
+        # the sidecar goes first, so a registered zip always has its weights next to it
+        with open(f"{weights_path(path)}.tmp", "wb") as f:
+            torch.save({**header, "state_dict": params["policy"]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{weights_path(path)}.tmp", weights_path(path))
+        os.replace(f"{path}.tmp", path)
+        self.registry.add(path, steps, payoff)
+        if self.keep_last is not None:
+            self.registry.prune(self.keep_last, self.keep_every)
+
+    @staticmethod
+    def to_cpu(obj: Any) -> Any:
+        # copies every tensor in a (nested) state_dict, so the optimizer can keep updating in place
+        if isinstance(obj, torch.Tensor):
+            return obj.detach().to("cpu", copy=True)
+        elif isinstance(obj, dict):
+            return {k: CheckpointWriter.to_cpu(v) for k, v in obj.items()}
+        elif isinstance(obj, (list, tuple)):
+            return type(obj)(CheckpointWriter.to_cpu(v) for v in obj)
+        else:
+            return obj
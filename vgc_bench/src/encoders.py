@@ -0,0 +1,56 @@
+from enum import Enum
+from typing import Generic, Iterable, TypeVar
+
+import numpy as np
+import numpy.typing as npt
+from poke_env.environment import (
+    Effect,
+    Field,
+    MoveCategory,
+    PokemonGender,
+    PokemonType,
+    SideCondition,
+    Status,
+    Target,
+    Weather,
+)
+
+E = TypeVar("E", bound=Enum)
+
+
+class OneHotEncoder(Generic[E]):
+    columns: dict[E, int]
+    size: int
+
+    def __init__(self, enum: type[E]):
+        self.columns = {member: i for i, member in enumerate(enum)}
+        self.size = len(self.columns)
+
+    def encode(self, members: Iterable[E | None]) -> npt.NDArray[np.float32]:
+        out = np.zeros(self.size, dtype=np.float32)
+        self.write(out, members)
+        return out
+
+    def encode_values(self, values: dict[E, float]) -> npt.NDArray[np.float32]:
+        out = np.zeros(self.size, dtype=np.float32)
+        self.write_values(out, values)
+        return out
+
+    # the write methods scatter into an already-zeroed slice, so their cost scales with the number
+    # of members set rather than the size of the enum
+    def write(self, out: npt.NDArray[np.float32], members: Iterable[E | None]):
+        out[[self.columns[m] for m in members if m in self.columns]] = 1
+
+    def write_values(self, out: npt.NDArray[np.float32], values: dict[E, float]):
+        out[[self.columns[m] for m in values]] = list(values.values())
+
+
+effect_encoder = OneHotEncoder(Effect)
+field_encoder = OneHotEncoder(Field)
+gender_encoder = OneHotEncoder(PokemonGender)
+move_category_encoder = OneHotEncoder(MoveCategory)
+pokemon_type_encoder = OneHotEncoder(PokemonType)
+side_condition_encoder = OneHotEncoder(SideCondition)
+status_encoder = OneHotEncoder(Status)
+target_encoder = OneHotEncoder(Target)
+weather_encoder = OneHotEncoder(Weather)
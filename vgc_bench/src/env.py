@@ -7,21 +7,27 @@ import numpy.typing as npt
 import supersuit as ss
 import torch
 from gymnasium import Env
-from gymnasium.spaces import Box
+from gymnasium.spaces import Box, Dict
 from gymnasium.wrappers import FrameStackObservation
-from poke_env.environment import AbstractBattle
+from poke_env.environment import AbstractBattle, DoubleBattle
 from poke_env.player import DoublesEnv, SingleAgentWrapper
 from poke_env.ps_client import AccountConfiguration, ServerConfiguration
-from src.agent import Agent
+from src.agent import Agent, ObservationWriter
+from src.checkpoints import SharedWeights, build_policy
 from src.teams import RandomTeamBuilder, TeamToggle
 from src.utils import (
     LearningStyle,
     allow_mirror_match,
     battle_format,
     chooses_on_teampreview,
+    compact_obs,
     doubles_chunk_obs_len,
+    doubles_glob_obs_len,
     moves,
     num_envs,
+    obs_dtype,
+    pokemon_obs_len,
+    side_obs_len,
 )
 from stable_baselines3.common.monitor import Monitor
 
@@ -30,18 +36,31 @@ class ShowdownEnv(DoublesEnv[npt.NDArray[np.float32]]):
     _teampreview_draft1: list[int]
     _teampreview_draft2: list[int]
     _learning_style: LearningStyle
+    _observation_writer: ObservationWriter
 
     def __init__(self, learning_style: LearningStyle, *args: Any, **kwargs: Any):
         super().__init__(*args, **kwargs)
         self.metadata = {"name": "showdown_v1", "render_modes": ["human"]}
         self.render_mode: str | None = None
         self.observation_spaces = {
-            agent: Box(-1, len(moves), shape=(12, doubles_chunk_obs_len), dtype=np.float32)
+            agent: (
+                Dict(
+                    {
+                        "glob": Box(-1, 1, shape=(doubles_glob_obs_len,), dtype=obs_dtype),
+                        "side": Box(-1, 1, shape=(2, side_obs_len), dtype=obs_dtype),
+                        "ids": Box(0, len(moves), shape=(12, 6), dtype=np.int16),
+                        "pokemon": Box(-1, 1, shape=(12, pokemon_obs_len - 6), dtype=obs_dtype),
+                    }
+                )
+                if compact_obs
+                else Box(-1, len(moves), shape=(12, doubles_chunk_obs_len), dtype=obs_dtype)
+            )
             for agent in self.possible_agents
         }
         self._teampreview_draft1 = []
         self._teampreview_draft2 = []
         self._learning_style = learning_style
+        self._observation_writer = ObservationWriter()
 
     @classmethod
     def create_env(
@@ -72,6 +91,11 @@ class ShowdownEnv(DoublesEnv[npt.NDArray[np.float32]]):
             env.agent2.teampreview = env.async_random_teampreview2
         if learning_style == LearningStyle.PURE_SELF_PLAY:
             if num_frames > 1:
+                # supersuit only stacks Box spaces, and the policy only detects the stack it flips
+                # for tensor observations
+                assert (
+                    not compact_obs
+                ), "pure self-play with frame stacking needs compact_obs = False"
                 env = ss.frame_stack_v2(env, stack_size=num_frames, stack_dim=0)
             env = ss.pettingzoo_env_to_vec_env_v1(env)
             env = ss.concat_vec_envs_v1(
@@ -93,7 +117,7 @@ class ShowdownEnv(DoublesEnv[npt.NDArray[np.float32]]):
                 open_timeout=None,
                 team=RandomTeamBuilder(teams, battle_format, toggle),
             )
-            env = SingleAgentWrapper(env, opponent)
+            env = OpponentWrapper(env, opponent)
             if num_frames > 1:
                 env = FrameStackObservation(env, num_frames, padding_type="zero")
             env = Monitor(env)
@@ -148,7 +172,11 @@ class ShowdownEnv(DoublesEnv[npt.NDArray[np.float32]]):
         teampreview_draft = (
             self._teampreview_draft1 if battle.player_role == "p1" else self._teampreview_draft2
         )
-        return Agent.embed_battle(battle, teampreview_draft, fake_ratings=True)
+        assert isinstance(battle, DoubleBattle)
+        obs = self._observation_writer.write(battle, teampreview_draft, fake_ratings=True)
+        if compact_obs:
+            return ObservationWriter.to_compact(obs, obs_dtype)  # type: ignore
+        return obs.astype(obs_dtype)
 
     def cleanup(self):
         dead_tags = [k for k, b in self.agent1.battles.items() if b.finished]
@@ -158,3 +186,18 @@ class ShowdownEnv(DoublesEnv[npt.NDArray[np.float32]]):
 
     def get_opp_win_rate(self) -> float:
         return self.agent2.win_rate
+
+
+class OpponentWrapper(SingleAgentWrapper):
+    def set_opp_weights(self, weights: SharedWeights):
+        # copies weights published by the trainer out of shared memory into the opponent's policy,
+        # which is built from the weights' header the first time
+        assert isinstance(self.opponent, Agent)
+        with weights.attach() as state_dict:
+            if self.opponent.has_policy:
+                self.opponent.set_policy_state_dict(state_dict)
+            else:
+                policy = build_policy(
+                    weights.header, state_dict, self.observation_space, self.action_space
+                )
+                self.opponent.set_policy(policy)
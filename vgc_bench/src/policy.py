@@ -1,25 +1,27 @@
 from __future__ import annotations
 
+from contextlib import contextmanager
 from typing import Any
 
 import torch
 from gymnasium import Space
-from gymnasium.spaces import Discrete
+from gymnasium.spaces import Discrete, MultiDiscrete
 from src.utils import (
-    abilities,
+    ability_ids,
     doubles_chunk_obs_len,
-    doubles_glob_obs_len,
-    items,
-    moves,
+    doubles_pokemon_offset,
+    doubles_side_offset,
+    item_ids,
+    move_ids,
     num_envs,
-    side_obs_len,
 )
 from stable_baselines3.common.base_class import BaseAlgorithm
-from stable_baselines3.common.distributions import Distribution, MultiCategoricalDistribution
+from stable_baselines3.common.distributions import Distribution
 from stable_baselines3.common.policies import ActorCriticPolicy
 from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
-from stable_baselines3.common.type_aliases import PyTorchObs
+from stable_baselines3.common.type_aliases import PyTorchObs, Schedule
 from torch import nn
+from torch.nn import functional as F
 
 
 class MaskedActorCriticPolicy(ActorCriticPolicy):
@@ -40,6 +42,57 @@ class MaskedActorCriticPolicy(ActorCriticPolicy):
             },
             share_features_extractor=False,
         )
+        self.ally_illegal_table: torch.Tensor
+        if isinstance(self.action_space, MultiDiscrete):
+            act_len = int(self.action_space.nvec[0])
+            ally_actions = torch.arange(act_len).unsqueeze(1)
+            indices = torch.arange(act_len).unsqueeze(0)
+            # row i marks the second slot's actions made illegal by the first slot taking action i
+            self.register_buffer(
+                "ally_illegal_table",
+                ((27 <= indices) & (indices < 87))
+                | ((indices >= 87) & (ally_actions >= 87))
+                | ((indices == ally_actions) & (1 <= ally_actions) & (ally_actions <= 6)),
+                persistent=False,
+            )
+
+    def _build(self, lr_schedule: Schedule):
+        super()._build(lr_schedule)
+        self.optimizer.register_load_state_dict_pre_hook(self.merge_embed_optimizer_state)
+
+    def merge_embed_optimizer_state(
+        self, optimizer: torch.optim.Optimizer, state_dict: dict[str, Any]
+    ) -> dict[str, Any]:
+        # optimizers saved before the embedding tables were concatenated hold one parameter per
+        # vocabulary, so their moments are concatenated the same way as the weights
+        legacy_names = [
+            (
+                [name.replace("id_embed", f"{v}_embed") for v in ["ability", "item", "move"]]
+                if name.endswith("id_embed.weight")
+                else [name]
+            )
+            for name, _ in self.named_parameters()
+        ]
+        groups = state_dict["param_groups"]
+        if len(groups) != 1 or len(groups[0]["params"]) != sum(len(n) for n in legacy_names):
+            return state_dict
+        old_ids = iter(groups[0]["params"])
+        state = {}
+        for i, names in enumerate(legacy_names):
+            old_states = [state_dict["state"].get(next(old_ids)) for _ in names]
+            if all(s is not None for s in old_states):
+                state[i] = {
+                    k: (
+                        torch.cat([s[k] for s in old_states])
+                        if isinstance(v, torch.Tensor) and v.dim() > 0
+                        else v
+                    )
+                    for k, v in old_states[0].items()
+                }
+        return {
+            "state": state,
+            "param_groups": [{**groups[0], "params": list(range(len(legacy_names)))}],
+        }
 
     @classmethod
     def clone(cls, model: BaseAlgorithm) -> MaskedActorCriticPolicy:
@@ -54,43 +107,156 @@ class MaskedActorCriticPolicy(ActorCriticPolicy):
         new_policy.load_state_dict(model.policy.state_dict())
         return new_policy
 
+    def quantize_inference(
+        self, state_dict: dict[str, torch.Tensor] | None = None
+    ) -> MaskedActorCriticPolicy:
+        # inference only: returns a CPU policy of the same architecture with the given float32
+        # weights (by default this policy's) and dynamically int8-quantized linear layers, left in
+        # train mode because the transformer fast path rejects quantized linears (dropout is 0)
+        policy = MaskedActorCriticPolicy(
+            self.observation_space,
+            self.action_space,
+            lambda _: 0,
+            num_frames=self.num_frames,
+            chooses_on_teampreview=self.chooses_on_teampreview,
+        )
+        policy.load_state_dict(self.state_dict() if state_dict is None else state_dict)
+        # without an optimizer, nothing keeps the replaced float32 linears alive
+        del policy.optimizer
+        # feature_proj stays in float32 since the extractors apply its weight piecewise
+        linears = {
+            name
+            for name, module in policy.named_modules()
+            if type(module) is nn.Linear and not name.endswith("feature_proj")
+        }
+        torch.ao.quantization.quantize_dynamic(policy, linears, dtype=torch.qint8, inplace=True)
+        return policy.train()
+
+    def compile_inference(self):
+        # inference only: the extractors are compiled with dynamic batch sizes, falling back to
+        # eager around the data-dependent parts (frame deduplication, per-stream caches)
+        self.eval()
+        for extractor in [self.pi_features_extractor, self.vf_features_extractor]:
+            extractor.forward = torch.compile(extractor.forward, dynamic=True)  # type: ignore
+
+    @contextmanager
+    def incremental(self, stream_keys: list[str]):
+        # inference only: while active, frame-stacked observations are treated as sliding windows of
+        # the given streams (one per batch row), and only their newest frames are encoded
+        extractors = [self.pi_features_extractor, self.vf_features_extractor]
+        for extractor in extractors:
+            assert isinstance(extractor, AttentionExtractor)
+            extractor.cache_keys = stream_keys
+        try:
+            yield
+        finally:
+            for extractor in extractors:
+                assert isinstance(extractor, AttentionExtractor)
+                extractor.cache_keys = None
+
+    def evict_stream(self, stream_key: str):
+        for extractor in [self.pi_features_extractor, self.vf_features_extractor]:
+            assert isinstance(extractor, AttentionExtractor)
+            extractor.frame_cache.pop(stream_key, None)
+
+    def clear_streams(self):
+        for extractor in [self.pi_features_extractor, self.vf_features_extractor]:
+            assert isinstance(extractor, AttentionExtractor)
+            extractor.frame_cache.clear()
+
     def forward(
-        self, obs: torch.Tensor, deterministic: bool = False
+        self, obs: PyTorchObs, deterministic: bool = False, action_mask: torch.Tensor | None = None
     ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
-        if not self._must_flip_frame_stack and obs.size(0) == 2 * num_envs and len(obs.size()) == 4:
+        if (
+            not self._must_flip_frame_stack
+            and isinstance(obs, torch.Tensor)
+            and obs.size(0) == 2 * num_envs
+            and len(obs.size()) == 4
+        ):
             self._must_flip_frame_stack = True
         if self._must_flip_frame_stack:
-            obs = obs.flip(1)
+            obs = self.flip_frame_stack(obs)
         action_logits, value_logits = self.get_logits(obs, actor_grad=True)
-        distribution = self.get_dist_from_logits(obs, action_logits)
-        actions = distribution.get_actions(deterministic=deterministic)
-        if isinstance(distribution, MultiCategoricalDistribution):
-            distribution2 = self.get_dist_from_logits(obs, action_logits, actions[:, :1])
-            assert isinstance(distribution2, MultiCategoricalDistribution)
-            actions2 = distribution2.get_actions(deterministic=deterministic)
-            distribution.distribution[1] = distribution2.distribution[1]
-            actions[:, 1] = actions2[:, 1]
-        log_prob = distribution.log_prob(actions)
+        if isinstance(self.action_space, MultiDiscrete):
+            actions, log_prob = self.sample_actions(
+                obs, action_logits, deterministic=deterministic, action_mask=action_mask
+            )
+        else:
+            distribution = self.get_dist_from_logits(obs, action_logits, action_mask=action_mask)
+            actions = distribution.get_actions(deterministic=deterministic)
+            log_prob = distribution.log_prob(actions)
         actions = actions.reshape((-1, *self.action_space.shape))  # type: ignore[misc]
         return actions, value_logits, log_prob
 
     def evaluate_actions(
         self, obs: PyTorchObs, actions: torch.Tensor
     ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor | None]:
-        assert isinstance(obs, torch.Tensor)
         if self._must_flip_frame_stack:
-            obs = obs.flip(1)
+            obs = self.flip_frame_stack(obs)
         action_logits, value_logits = self.get_logits(obs, self.actor_grad)
-        distribution = self.get_dist_from_logits(obs, action_logits)
-        if isinstance(distribution, MultiCategoricalDistribution):
-            distribution2 = self.get_dist_from_logits(obs, action_logits, actions[:, :1])
-            assert isinstance(distribution2, MultiCategoricalDistribution)
-            distribution.distribution[1] = distribution2.distribution[1]
-        log_prob = distribution.log_prob(actions)
-        entropy = distribution.entropy()
+        if isinstance(self.action_space, MultiDiscrete):
+            log_prob, entropy = self.evaluate_log_probs(obs, action_logits, actions)
+        else:
+            distribution = self.get_dist_from_logits(obs, action_logits)
+            log_prob = distribution.log_prob(actions)
+            entropy = distribution.entropy()
         return value_logits, log_prob, entropy
 
-    def get_logits(self, obs: torch.Tensor, actor_grad: bool) -> tuple[torch.Tensor, torch.Tensor]:
+    def sample_actions(
+        self,
+        obs: PyTorchObs,
+        action_logits: torch.Tensor,
+        deterministic: bool = False,
+        action_mask: torch.Tensor | None = None,
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        # samples slot 1, then slot 2 under the mask conditioned on slot 1's action, computing each
+        # head's masked log-softmax once; matches splicing two MultiCategoricalDistributions
+        act_len = self.action_space.nvec[0]  # type: ignore
+        illegal = self.get_illegal(obs, action_mask)
+        log_probs1 = self.masked_log_softmax(action_logits[:, :act_len], illegal[:, :act_len])
+        actions1 = self.sample(log_probs1, deterministic)
+        illegal2 = illegal[:, act_len:] | self.get_ally_illegal(actions1)
+        log_probs2 = self.masked_log_softmax(action_logits[:, act_len:], illegal2)
+        actions2 = self.sample(log_probs2, deterministic)
+        log_prob = log_probs1.gather(1, actions1) + log_probs2.gather(1, actions2)
+        return torch.cat([actions1, actions2], dim=1), log_prob.squeeze(1)
+
+    def evaluate_log_probs(
+        self, obs: PyTorchObs, action_logits: torch.Tensor, actions: torch.Tensor
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        # with both actions known, the two heads are masked and normalized in a single pass
+        act_len = self.action_space.nvec[0]  # type: ignore
+        actions = actions.long()
+        illegal = self.get_illegal(obs)
+        illegal[:, act_len:] |= self.get_ally_illegal(actions[:, :1])
+        illegal = illegal.view(-1, 2, act_len)
+        log_probs = self.masked_log_softmax(action_logits.view(-1, 2, act_len), illegal)
+        log_prob = log_probs.gather(2, actions.unsqueeze(2)).sum(dim=(1, 2))
+        # clamped like Categorical.entropy, so masked slots contribute 0 * finite in both the value
+        # and its gradient (masked_fill alone leaves 0 * -inf = NaN in the backward pass)
+        clamped = log_probs.clamp(min=torch.finfo(log_probs.dtype).min)
+        entropy = -(log_probs.exp() * clamped).sum(dim=(1, 2))
+        return log_prob, entropy
+
+    @staticmethod
+    def masked_log_softmax(logits: torch.Tensor, illegal: torch.Tensor) -> torch.Tensor:
+        return torch.log_softmax(logits.masked_fill(illegal, float("-inf")), dim=-1)
+
+    @staticmethod
+    def sample(log_probs: torch.Tensor, deterministic: bool) -> torch.Tensor:
+        # draws the same way torch.distributions.Categorical.sample does
+        if deterministic:
+            return log_probs.argmax(dim=-1, keepdim=True)
+        return torch.multinomial(log_probs.exp(), 1, True)
+
+    @staticmethod
+    def flip_frame_stack(obs: PyTorchObs) -> PyTorchObs:
+        if isinstance(obs, dict):
+            return {k: v.flip(1) for k, v in obs.items()}
+        assert isinstance(obs, torch.Tensor)
+        return obs.flip(1)
+
+    def get_logits(self, obs: PyTorchObs, actor_grad: bool) -> tuple[torch.Tensor, torch.Tensor]:
         actor_context = torch.enable_grad() if actor_grad else torch.no_grad()
         features = self.extract_features(obs)  # type: ignore
         if self.share_features_extractor:
@@ -106,39 +272,52 @@ class MaskedActorCriticPolicy(ActorCriticPolicy):
         return action_logits, value_logits
 
     def get_dist_from_logits(
-        self, obs: torch.Tensor, action_logits: torch.Tensor, action: torch.Tensor | None = None
+        self,
+        obs: PyTorchObs,
+        action_logits: torch.Tensor,
+        action: torch.Tensor | None = None,
+        action_mask: torch.Tensor | None = None,
     ) -> Distribution:
-        mask = self.get_mask(obs, action)
+        mask = self.get_mask(obs, action, action_mask)
         distribution = self.action_dist.proba_distribution(action_logits + mask)
         return distribution
 
-    def get_mask(self, obs: torch.Tensor, ally_actions: torch.Tensor | None = None) -> torch.Tensor:
-        chunk = obs[:, -1, 0, :] if self.num_frames > 1 else obs[:, 0, :]
+    def get_mask(
+        self,
+        obs: PyTorchObs,
+        ally_actions: torch.Tensor | None = None,
+        action_mask: torch.Tensor | None = None,
+    ) -> torch.Tensor:
         if isinstance(self.action_space, Discrete):
+            chunk = self.get_chunk(obs)
             mask = chunk[:, : self.action_space.n]  # type: ignore
             mask = torch.where(mask.sum(dim=1, keepdim=True) == mask.size(1), 0.0, mask)
             mask = torch.where(mask == 1, float("-inf"), mask)
             return mask
         else:
             act_len = self.action_space.nvec[0]  # type: ignore
-            if ally_actions is None:
-                mask = chunk[:, : 2 * act_len]
-            else:
-                mask = chunk[:, act_len : 2 * act_len]
-                ally_switched = (1 <= ally_actions) & (ally_actions <= 6)
-                ally_terastallized = ally_actions >= 87
-                # creating a (batch_size, act_len) size array of 0..act_len - 1 ranges
-                indices = torch.arange(act_len, device=mask.device).unsqueeze(0).expand_as(mask)
-                # marking values in indices as being invalid actions due to ally action
-                ally_mask = (
-                    ((27 <= indices) & (indices < 87))
-                    | ((indices >= 87) & ally_terastallized)
-                    | ((indices == ally_actions) & ally_switched)
-                )
-                mask = torch.where(ally_mask, 1.0, mask)
-                mask = torch.cat([chunk[:, :act_len], mask], dim=1)
-            mask = torch.where(mask == 1, float("-inf"), mask)
-            return mask
+            illegal = self.get_illegal(obs, action_mask)
+            if ally_actions is not None:
+                illegal[:, act_len:] |= self.get_ally_illegal(ally_actions)
+            return torch.where(illegal, float("-inf"), 0.0)
+
+    def get_chunk(self, obs: PyTorchObs) -> torch.Tensor:
+        if isinstance(obs, dict):
+            return obs["glob"][:, -1] if self.num_frames > 1 else obs["glob"]
+        assert isinstance(obs, torch.Tensor)
+        return obs[:, -1, 0, :] if self.num_frames > 1 else obs[:, 0, :]
+
+    def get_illegal(self, obs: PyTorchObs, action_mask: torch.Tensor | None = None) -> torch.Tensor:
+        # action_mask optionally carries the (batch_size, 2 * act_len) bool mask of legal actions
+        # alongside the observation, so it doesn't have to be read back out of the features
+        if action_mask is not None:
+            return ~action_mask
+        act_len = self.action_space.nvec[0]  # type: ignore
+        return self.get_chunk(obs)[:, : 2 * act_len] == 1
+
+    def get_ally_illegal(self, ally_actions: torch.Tensor) -> torch.Tensor:
+        # ally_actions is (batch_size, 1); gathers each row's ally-conditioned mask from the table
+        return self.ally_illegal_table[ally_actions.squeeze(1).long()]
 
 
 class AttentionExtractor(BaseFeaturesExtractor):
@@ -146,6 +325,8 @@ class AttentionExtractor(BaseFeaturesExtractor):
     embed_len: int = 32
     proj_len: int = 128
     embed_layers: int = 3
+    frame_cache: dict[str, torch.Tensor]
+    cache_keys: list[str] | None
 
     def __init__(
         self, observation_space: Space[Any], num_frames: int, chooses_on_teampreview: bool
@@ -153,9 +334,16 @@ class AttentionExtractor(BaseFeaturesExtractor):
         super().__init__(observation_space, features_dim=self.proj_len)
         self.num_frames = num_frames
         self.chooses_on_teampreview = chooses_on_teampreview
-        self.ability_embed = nn.Embedding(len(abilities), self.embed_len)
-        self.item_embed = nn.Embedding(len(items), self.embed_len)
-        self.move_embed = nn.Embedding(len(moves), self.embed_len)
+        # ability, item and move ids index one concatenated embedding table through id_offsets
+        self.id_embed = nn.Embedding(
+            len(ability_ids) + len(item_ids) + len(move_ids), self.embed_len
+        )
+        self.id_offsets: torch.Tensor
+        move_offset = len(ability_ids) + len(item_ids)
+        self.register_buffer(
+            "id_offsets", torch.tensor([0, len(ability_ids)] + [move_offset] * 4), persistent=False
+        )
+        self.register_load_state_dict_pre_hook(self.merge_embed_tables)
         self.feature_proj = nn.Linear(
             doubles_chunk_obs_len + 6 * (self.embed_len - 1), self.proj_len
         )
@@ -171,6 +359,8 @@ class AttentionExtractor(BaseFeaturesExtractor):
             ),
             num_layers=self.embed_layers,
         )
+        self.frame_cache = {}
+        self.cache_keys = None
         self.frame_encoding: torch.Tensor
         if num_frames > 1:
             self.register_buffer("frame_encoding", torch.eye(num_frames).unsqueeze(0))
@@ -189,34 +379,89 @@ class AttentionExtractor(BaseFeaturesExtractor):
                 num_layers=self.embed_layers,
             )
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
-        batch_size = x.size(0)
-        # embedding
-        start = doubles_glob_obs_len + side_obs_len
-        x = torch.cat(
-            [
-                x[..., :start],
-                self.ability_embed(x[..., start].long()),
-                self.item_embed(x[..., start + 1].long()),
-                self.move_embed(x[..., start + 2].long()),
-                self.move_embed(x[..., start + 3].long()),
-                self.move_embed(x[..., start + 4].long()),
-                self.move_embed(x[..., start + 5].long()),
-                x[..., start + 6 :],
-            ],
-            dim=-1,
+    @staticmethod
+    def merge_embed_tables(module: nn.Module, state_dict: dict[str, Any], prefix: str, *args: Any):
+        # checkpoints saved before the tables were concatenated hold one embedding per vocabulary
+        keys = [f"{prefix}{name}_embed.weight" for name in ["ability", "item", "move"]]
+        if all(k in state_dict for k in keys):
+            state_dict[f"{prefix}id_embed.weight"] = torch.cat([state_dict.pop(k) for k in keys])
+
+    def forward(self, x: torch.Tensor | dict[str, torch.Tensor]) -> torch.Tensor:
+        if isinstance(x, dict):
+            return self.forward_compact(x)
+        # feature_proj is applied piecewise: the float columns and the id embeddings are projected
+        # separately and summed, so no widened copy of the rows is built
+        start = doubles_pokemon_offset
+        weight = self.feature_proj.weight
+        x = (
+            F.linear(x[..., :start], weight[:, :start], self.feature_proj.bias)
+            + F.linear(x[..., start + 6 :], weight[:, start + 6 * self.embed_len :])
+            + self.project_ids(x[..., start : start + 6].long())
         )
-        # frame encoder
-        x = x.view(batch_size * self.num_frames, self.num_pokemon, -1)
-        x = self.feature_proj(x)
-        token = self.cls_token.expand(batch_size * self.num_frames, -1, -1)
-        x = torch.cat([token, x], dim=1)
-        x = self.frame_encoder(x)[:, 0, :]
+        return self.encode(x, x.size(0))
+
+    def forward_compact(self, x: dict[str, torch.Tensor]) -> torch.Tensor:
+        # same projection as forward, but the global and side vectors are projected once per sample
+        # and per team before being added to the 12 rows
+        weight = self.feature_proj.weight
+        glob = F.linear(x["glob"], weight[:, :doubles_side_offset], self.feature_proj.bias)
+        side = F.linear(x["side"], weight[:, doubles_side_offset:doubles_pokemon_offset])
+        pokemon = F.linear(x["pokemon"], weight[:, doubles_pokemon_offset + 6 * self.embed_len :])
+        pokemon = pokemon + self.project_ids(x["ids"].long()) + glob.unsqueeze(-2)
+        pokemon = pokemon.unflatten(-2, (2, self.num_pokemon // 2)) + side.unsqueeze(-2)
+        return self.encode(pokemon.flatten(-3, -2), pokemon.size(0))
+
+    def project_ids(self, ids: torch.Tensor) -> torch.Tensor:
+        embeds = self.id_embed(ids + self.id_offsets).flatten(-2)
+        start = doubles_pokemon_offset
+        return F.linear(embeds, self.feature_proj.weight[:, start : start + 6 * self.embed_len])
+
+    def encode(self, x: torch.Tensor, batch_size: int) -> torch.Tensor:
         if self.num_frames == 1:
-            return x
+            return self.encode_frames(x.view(batch_size, self.num_pokemon, -1))
+        x = x.view(batch_size, self.num_frames, self.num_pokemon, -1)
+        if self.cache_keys is None:
+            x = self.encode_unique_frames(x.flatten(0, 1)).view(batch_size, self.num_frames, -1)
+        else:
+            x = self.encode_frames_cached(x)
         # meta encoder
-        x = x.view(batch_size, self.num_frames, -1)
         frame_encoding = self.frame_encoding.expand(batch_size, -1, -1)
         x = torch.cat([x, frame_encoding], dim=2)
         x = self.frame_proj(x)
         return self.meta_encoder(x, mask=self.mask, is_causal=True)[:, -1, :]
+
+    def encode_frames(self, x: torch.Tensor) -> torch.Tensor:
+        # frame encoder
+        token = self.cls_token.expand(x.size(0), -1, -1)
+        x = torch.cat([token, x], dim=1)
+        return self.frame_encoder(x)[:, 0, :]
+
+    def encode_unique_frames(self, x: torch.Tensor) -> torch.Tensor:
+        # windows of neighbouring timesteps share frames, and all early windows share the zero
+        # padding, so each distinct frame is encoded once and the windows are gathered back by index
+        unique, inverse = torch.unique(x.detach().flatten(1), dim=0, return_inverse=True)
+        if unique.size(0) == x.size(0):
+            return self.encode_frames(x)
+        indices = torch.arange(x.size(0), device=x.device)
+        first = torch.full((unique.size(0),), x.size(0), device=x.device)
+        first = first.scatter_reduce(0, inverse, indices, reduce="amin")
+        return self.encode_frames(x[first])[inverse]
+
+    def encode_frames_cached(self, x: torch.Tensor) -> torch.Tensor:
+        # each stream's window has advanced by exactly one frame since its last call, so only the
+        # newest frame is encoded and the older encodings are reused; new streams encode everything
+        assert self.cache_keys is not None and len(self.cache_keys) == x.size(0)
+        hits = [i for i, k in enumerate(self.cache_keys) if k in self.frame_cache]
+        misses = [i for i, k in enumerate(self.cache_keys) if k not in self.frame_cache]
+        frames = x.new_empty(x.size(0), self.num_frames, self.proj_len)
+        if hits:
+            cached = torch.stack([self.frame_cache[self.cache_keys[i]][1:] for i in hits])
+            newest = self.encode_frames(x[hits, -1]).unsqueeze(1)
+            frames[hits] = torch.cat([cached, newest], dim=1)
+        if misses:
+            frames[misses] = self.encode_frames(x[misses].flatten(0, 1)).view(
+                len(misses), self.num_frames, -1
+            )
+        for k, f in zip(self.cache_keys, frames):
+            self.frame_cache[k] = f
+        return frames
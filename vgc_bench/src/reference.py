@@ -0,0 +1,64 @@
+import torch
+from src.policy import MaskedActorCriticPolicy
+from src.utils import (
+    abilities,
+    doubles_act_len,
+    doubles_chunk_obs_len,
+    doubles_pokemon_offset,
+    items,
+    moves,
+)
+
+# random policy inputs and the two-distribution sampler that MaskedActorCriticPolicy.sample_actions
+# replaced, which the fused sampler is checked and benchmarked against
+
+
+def random_obs(
+    batch_size: int, num_frames: int = 1, seed: int = 0
+) -> tuple[torch.Tensor, torch.Tensor]:
+    rng = torch.Generator().manual_seed(seed)
+    frame_shape = (
+        (12, doubles_chunk_obs_len) if num_frames == 1 else (num_frames, 12, doubles_chunk_obs_len)
+    )
+    obs = torch.rand(batch_size, *frame_shape, generator=rng)
+    # about half of the actions are legal, and passing is always legal so both slots can act
+    action_mask = torch.rand(batch_size, 2 * doubles_act_len, generator=rng) < 0.5
+    action_mask[:, [0, doubles_act_len]] = True
+    obs[..., : 2 * doubles_act_len] = (
+        (~action_mask).float().view(batch_size, *[1] * (len(frame_shape) - 1), -1)
+    )
+    vocab_len = min(len(abilities), len(items), len(moves))
+    obs[..., doubles_pokemon_offset : doubles_pokemon_offset + 6] = torch.randint(
+        0, vocab_len, (batch_size, *frame_shape[:-1], 6), generator=rng
+    ).float()
+    return obs, action_mask
+
+
+def spliced_sample(
+    policy: MaskedActorCriticPolicy,
+    obs: torch.Tensor,
+    action_logits: torch.Tensor,
+    deterministic: bool,
+    action_mask: torch.Tensor,
+) -> tuple[torch.Tensor, torch.Tensor]:
+    # the two-distribution sampler that MaskedActorCriticPolicy.sample_actions replaced
+    distribution = policy.get_dist_from_logits(obs, action_logits, action_mask=action_mask)
+    actions = distribution.get_actions(deterministic=deterministic)
+    distribution2 = policy.get_dist_from_logits(
+        obs, action_logits, actions[:, :1], action_mask=action_mask
+    )
+    actions[:, 1] = distribution2.get_actions(deterministic=deterministic)[:, 1]
+    distribution.distribution[1] = distribution2.distribution[1]  # type: ignore
+    return actions, distribution.log_prob(actions)
+
+
+def spliced_evaluate(
+    policy: MaskedActorCriticPolicy,
+    obs: torch.Tensor,
+    action_logits: torch.Tensor,
+    actions: torch.Tensor,
+) -> tuple[torch.Tensor, torch.Tensor]:
+    distribution = policy.get_dist_from_logits(obs, action_logits)
+    distribution2 = policy.get_dist_from_logits(obs, action_logits, actions[:, :1])
+    distribution.distribution[1] = distribution2.distribution[1]  # type: ignore
+    return distribution.log_prob(actions), distribution.entropy()  # type: ignore
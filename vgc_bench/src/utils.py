@@ -54,6 +54,15 @@ num_envs = 24
 steps = 98_304
 allow_mirror_match = True
 chooses_on_teampreview = True
+compact_obs = False
+# compile the policies of Agents (evaluation agents and env opponents) with torch.compile
+compile_inference = False
+# run the policies of Agents as dynamically int8-quantized CPU models
+quantize_inference = False
+# storage dtype of observations in envs, rollout buffers and trajectories, e.g. np.float16
+obs_dtype = np.float32
+# memory budget of the policy checkpoint cache that self-play opponents are loaded through
+policy_cache_mb = 1024
 
 # observation length constants
 singles_act_len = 26
@@ -62,12 +71,30 @@ singles_glob_obs_len = singles_act_len + len(Field) + len(Weather) + 7
 doubles_glob_obs_len = 2 * doubles_act_len + len(Field) + len(Weather) + 3
 side_obs_len = len(SideCondition) + 5
 move_obs_len = len(MoveCategory) + len(Target) + len(PokemonType) + 11
+move_pp_frac_offset = len(MoveCategory) + len(Target) + 10
 pokemon_obs_len = (
     4 * move_obs_len + len(Effect) + len(PokemonGender) + 2 * len(PokemonType) + len(Status) + 39
 )
 singles_chunk_obs_len = singles_glob_obs_len + side_obs_len + pokemon_obs_len
 doubles_chunk_obs_len = doubles_glob_obs_len + side_obs_len + pokemon_obs_len
 
+# column offsets within a doubles chunk
+doubles_weather_offset = 2 * doubles_act_len
+doubles_field_offset = doubles_weather_offset + len(Weather)
+doubles_flag_offset = doubles_field_offset + len(Field)
+doubles_side_offset = doubles_glob_obs_len
+doubles_pokemon_offset = doubles_glob_obs_len + side_obs_len
+# column offsets within a pokemon embedding
+pokemon_move_offset = 6
+pokemon_type_offset = pokemon_move_offset + 4 * move_obs_len
+pokemon_stat_offset = pokemon_type_offset + 2 * len(PokemonType)
+pokemon_gender_offset = pokemon_stat_offset + 6
+pokemon_volatile_offset = pokemon_gender_offset + len(PokemonGender) + 1
+pokemon_status_offset = pokemon_volatile_offset + 2
+pokemon_boost_offset = pokemon_status_offset + len(Status) + 1
+pokemon_effect_offset = pokemon_boost_offset + 7
+pokemon_flag_offset = pokemon_effect_offset + len(Effect)
+
 # pokemon data
 with open("data/abilities.json") as f:
     ability_descs: dict[str, npt.NDArray[np.float32]] = json.load(f)
@@ -81,3 +108,24 @@ with open("data/moves.json") as f:
     move_descs: dict[str, npt.NDArray[np.float32]] = json.load(f)
     moves = list(move_descs.keys())
     move_embeds = list(move_descs.values())
+
+# vocabulary lookup tables, unknown ids fall back to the null entry at index 0
+ability_ids = {a: i for i, a in enumerate(abilities)}
+item_ids = {it: i for i, it in enumerate(items)}
+move_ids = {m: i for i, m in enumerate(moves)}
+# the dense layout stores vocabulary ids as floats, so they have to stay exact in obs_dtype
+assert all(
+    obs_dtype(len(vocab) - 1) == len(vocab) - 1 for vocab in [abilities, items, moves]
+), f"{np.dtype(obs_dtype).name} can't represent every vocabulary id exactly"
+
+
+def get_ability_id(ability: str | None) -> int:
+    return ability_ids.get("null" if ability is None else ability, 0)
+
+
+def get_item_id(item: str | None) -> int:
+    return item_ids.get("null" if item is None else item, 0)
+
+
+def get_move_id(move: str) -> int:
+    return move_ids.get("hiddenpower" if move.startswith("hiddenpower") else move, 0)
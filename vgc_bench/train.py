@@ -1,7 +1,7 @@
 import argparse
-import os
 
 from src.callback import Callback
+from src.checkpoints import CheckpointRegistry
 from src.env import ShowdownEnv
 from src.policy import MaskedActorCriticPolicy
 from src.utils import LearningStyle, allow_mirror_match, chooses_on_teampreview, num_envs, steps
@@ -54,27 +54,16 @@ def train(
         device=device,
     )
     num_saved_timesteps = 0
-    if (
-        os.path.exists(f"results/saves-{run_ident}/{','.join([str(t) for t in teams])}-teams")
-        and len(os.listdir(f"results/saves-{run_ident}/{','.join([str(t) for t in teams])}-teams"))
-        > 0
-    ):
-        saved_policy_timesteps = [
-            int(file[:-4])
-            for file in os.listdir(
-                f"results/saves-{run_ident}/{','.join([str(t) for t in teams])}-teams"
-            )
-            if int(file[:-4]) >= 0
-        ]
-        if saved_policy_timesteps:
-            num_saved_timesteps = max(saved_policy_timesteps)
-            ppo.set_parameters(
-                f"results/saves-{run_ident}/{','.join([str(t) for t in teams])}-teams/{num_saved_timesteps}.zip",
-                device=ppo.device,
-            )
-            if num_saved_timesteps < steps:
-                num_saved_timesteps = 0
-            ppo.num_timesteps = num_saved_timesteps
+    registry = CheckpointRegistry(
+        f"results/saves-{run_ident}/{','.join([str(t) for t in teams])}-teams"
+    )
+    latest = registry.latest()
+    if latest is not None:
+        num_saved_timesteps = latest["steps"]
+        ppo.set_parameters(registry.path(latest["file"]), device=ppo.device)
+        if num_saved_timesteps < steps:
+            num_saved_timesteps = 0
+        ppo.num_timesteps = num_saved_timesteps
     ppo.learn(
         steps,
         callback=Callback(teams, port, device, learning_style, behavior_clone, num_frames),